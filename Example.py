@@ -1,38 +1,43 @@
+import uuid
 from typing import Annotated, Sequence, TypedDict
 from dotenv import load_dotenv
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.tools import tool
+from langchain_core.tools import tool, InjectedToolCallId
+from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph.message import add_messages
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt import ToolNode, InjectedState
+from langgraph.types import Command
 import json
 
 # Load environment variables
 load_dotenv()
 
-# Global variable to store the story content
-document_content = ""
-
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
+    # The story content, part of the state so every conversation (thread) has its own
+    document: str
 
 @tool
-def update(content: str) -> str:
+def update(content: str, tool_call_id: Annotated[str, InjectedToolCallId]) -> Command:
     """Updates the document with the provided story content."""
-    global document_content
-    document_content = content
-    return f"The story has been updated successfully! The current story is:\n{document_content}"
+    return Command(update={
+        "document": content,
+        "messages": [ToolMessage(
+            content=f"The story has been updated successfully! The current story is:\n{content}",
+            tool_call_id=tool_call_id,
+        )],
+    })
 
 @tool
-def save(filename: str) -> str:
+def save(filename: str, state: Annotated[dict, InjectedState]) -> str:
     """Save the current story to a text file and finish the process."""
-    global document_content
     if not filename.endswith('.txt'):
         filename = f"{filename}.txt"
     try:
         with open(filename, 'w') as file:
-            file.write(document_content)
+            file.write(state.get("document", ""))
         print(f"\n💾 Story has been saved to: {filename}")
         return f"Story has been saved successfully to '{filename}'."
     except Exception as e:
@@ -45,7 +50,7 @@ model = ChatGoogleGenerativeAI(model="gemini-2.0-flash").bind_tools(tools)
 
 # Agent logic
 def our_agent(state: AgentState) -> AgentState:
-    global document_content
+    document_content = state.get("document", "")
     system_prompt = SystemMessage(content=f"""
 You are StoryBot, a professional story and film development assistant.
 
@@ -83,7 +88,8 @@ Current stored story:
     if hasattr(response, "tool_calls") and response.tool_calls:
         print(f"🔧 USING TOOLS: {[tc['name'] for tc in response.tool_calls]}")
 
-    return {"messages": list(state["messages"]) + [user_message, response]}
+    # add_messages appends them to the history
+    return {"messages": [user_message, response]}
 
 # Whether to continue or stop
 def should_continue(state: AgentState) -> str:
@@ -112,13 +118,15 @@ graph.add_node("tools", ToolNode(tools))
 graph.set_entry_point("agent")
 graph.add_edge("agent", "tools")
 graph.add_conditional_edges("tools", should_continue, {"continue": "agent", "end": END})
-app = graph.compile()
+# The checkpointer keeps each thread's messages and document between steps
+app = graph.compile(checkpointer=MemorySaver())
 
 # Runner
 def run_story_agent():
     print("\n ===== STORYBOT =====")
-    state = {"messages": []}
-    for step in app.stream(state, stream_mode="values"):
+    state = {"messages": [], "document": ""}
+    config = {"configurable": {"thread_id": uuid.uuid4().hex}}
+    for step in app.stream(state, config, stream_mode="values"):
         if "messages" in step:
             print_messages(step["messages"])
     print("\n ===== STORYBOT FINISHED =====")
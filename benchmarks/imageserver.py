@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+
+@lru_cache(maxsize=256)
+def make_jpeg(n: int, width: int, height: int) -> bytes:
+    image = Image.new("RGB", (width, height), ((n * 37) % 256, (n * 91) % 256, (n * 53) % 256))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=2)
+def noise_image(width: int, height: int) -> Image.Image:
+    return Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+
+
+def make_noise_jpeg(n: int, width: int, height: int) -> bytes:
+    '''Random pixels barely compress, so this is as large as a real high resolution photo gets.
+    A corner block keyed on n makes every image distinct, so none of them are deduplicated'''
+    image = noise_image(width, height).copy()
+    image.paste((n * 37 % 256, n * 11 % 256, n // 256 % 256), (0, 0, 64, 64))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    '''Serves /img/<n>.jpg?delay=<s>&w=<px>&h=<px> and /hang, which never answers in time'''
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        delay = float(query.get("delay", [self.server.delay])[0])
+
+        if url.path == "/hang":
+            time.sleep(3600)
+            return
+        if not url.path.startswith("/img/"):
+            self.send_error(404)
+            return
+
+        time.sleep(delay)
+        n = int(url.path.rsplit("/", 1)[-1].split(".")[0])
+        width = int(query.get("w", [self.server.width])[0])
+        height = int(query.get("h", [self.server.height])[0])
+        if self.server.noise:
+            body = make_noise_jpeg(n, width, height)
+        else:
+            body = make_jpeg(n, width, height)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def image_server(delay: float = 0.05, width: int = 1600, height: int = 1200, noise: bool = False):
+    '''Local stand-in for the image hosts, yields its base url'''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.width = width
+    server.height = height
+    server.noise = noise
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
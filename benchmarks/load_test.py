@@ -0,0 +1,122 @@
+# python -m benchmarks.load_test [requests] [concurrency] [routes...]
+#
+# Drives every route of the app in-process with the fake LLM backend and a local image server,
+# and reports latency percentiles and throughput per route. Needs no network access and no API key.
+# FAKE_LLM_LATENCY and FAKE_LLM_SIZE set the model latency and answer size.
+
+import os
+import tempfile
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY", "0.2")
+os.environ.setdefault("IMAGE_CACHE_DIR", tempfile.mkdtemp(prefix="cinespark-bench-images-"))
+os.environ.setdefault("PROJECT_STORE_PATH", os.path.join(tempfile.mkdtemp(prefix="cinespark-bench-projects-"), "projects.sqlite3"))
+
+import asyncio
+import sys
+import time
+
+import httpx
+
+import main
+import storygraphs
+from benchmarks.imageserver import image_server
+from benchmarks.photo_fetch import make_board
+from fakellm import fake_shots, fake_story
+
+
+def percentile(values, p: float) -> float:
+    '''Nearest-rank percentile of an already sorted list'''
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+def make_documents(base_url: str):
+    story = fake_story(12)
+    shots = [dict(shot, shot_number=i + 1) for i, shot in enumerate(fake_shots(100, scenes=12))]
+    board = [shot.model_dump() for shot in make_board(base_url, 20)]
+    return story, shots, board
+
+
+async def make_project(client: httpx.AsyncClient, story, shots, board) -> str:
+    '''The same documents stored server side, for the project_id variants of the routes'''
+    project_id = (await client.post("/projects", json={"name": "Bench"})).json()["id"]
+    for kind, document in (("story", story), ("shot", shots), ("photo", board)):
+        (await client.put(f"/projects/{project_id}/{kind}", json=document)).raise_for_status()
+    return project_id
+
+
+def make_routes(story, shots, board, project_id: str):
+    '''(name, method, path, payload for request i), each payload is unique so no cache answers it'''
+    return [
+        ("story", "POST", "/generate_story", lambda i: {"idea": f"idea {i}", "no_cache": True}),
+        ("story patch", "POST", "/generate_story", lambda i: {"idea": f"change {i}", "story": story, "mode": "patch", "no_cache": True}),
+        ("story stream", "POST", "/generate_story/stream", lambda i: {"idea": f"idea {i}", "no_cache": True}),
+        ("shot", "POST", "/generate_shot", lambda i: {"idea": f"idea {i}", "story": story, "no_cache": True}),
+        ("shot per scene", "POST", "/generate_shot", lambda i: {"idea": f"idea {i}", "story": story, "per_scene": True, "no_cache": True}),
+        ("photo", "POST", "/generate_photo", lambda i: {"idea": f"idea {i}", "story": story, "shot": shots, "no_cache": True}),
+        ("pdf story", "POST", "/generate-pdf-story", lambda i: {"project_name": f"Bench {i}", "story": story}),
+        ("pdf shot", "POST", "/generate-pdf-shot", lambda i: {"project_name": f"Bench {i}", "shot": shots}),
+        ("pdf photo", "POST", "/generate-pdf-photo", lambda i: {"project_name": f"Bench {i}", "photo": board}),
+        ("pdf bundle", "POST", "/generate-pdf-bundle", lambda i: {"project_name": f"Bundle {i}", "story": story, "shot": shots, "photo": board}),
+        # Same renders with the documents taken from the project store instead of the request body
+        ("shot project", "POST", "/generate_shot", lambda i: {"idea": f"idea {i}", "project_id": project_id, "story_version": 1, "no_cache": True}),
+        # Versions are pinned, "shot project" saves new shot lists as it runs
+        ("pdf shot project", "POST", "/generate-pdf-shot", lambda i: {"project_name": f"Bench {i}", "project_id": project_id, "shot_version": 1}),
+        ("pdf bundle project", "POST", "/generate-pdf-bundle", lambda i: {
+            "project_name": f"Bundle {i}", "project_id": project_id, "story_version": 1, "shot_version": 1, "photo_version": 1}),
+        ("stats", "GET", "/stats", lambda i: None),
+        ("metrics", "GET", "/metrics", lambda i: None),
+    ]
+
+
+async def run_route(client: httpx.AsyncClient, method: str, path: str, payload, requests: int, concurrency: int):
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with limit:
+            start = time.perf_counter()
+            response = await client.request(method, path, json=payload(i))
+            # Streamed bodies are read to the end, the latency is the full answer
+            await response.aread()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return sorted(latencies), errors, time.perf_counter() - start
+
+
+async def run(requests: int, concurrency: int, only):
+    with image_server(delay=0.02, width=1200, height=900) as base_url:
+        async with main.lifespan(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+                print(f"{requests} requests per route, {concurrency} concurrent, "
+                      f"fake LLM {storygraphs.model.latency * 1000:.0f} ms / {storygraphs.model.size} items")
+                print(f"{'route':<18} {'ok':>5} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+                documents = make_documents(base_url)
+                project_id = await make_project(client, *documents)
+                for name, method, path, payload in make_routes(*documents, project_id):
+                    if only and name.split()[0] not in only and name not in only:
+                        continue
+                    latencies, errors, elapsed = await run_route(client, method, path, payload, requests, concurrency)
+                    print(f"{name:<18} {len(latencies) - errors:>5} {errors:>5} "
+                          f"{percentile(latencies, 50) * 1000:>9.1f} {percentile(latencies, 95) * 1000:>9.1f} "
+                          f"{percentile(latencies, 99) * 1000:>9.1f} {len(latencies) / elapsed:>8.1f}")
+
+
+def main_cli():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(run(requests, concurrency, set(sys.argv[3:])))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,54 @@
+# python -m benchmarks.pdf_generators [counts...]
+#
+# Times the story, shot list and photoboard generators directly, at 10, 100 and 1000 items by default
+# (scenes for the story, shots for the other two). Photoboard images come from a local image server
+# into a fresh image cache, so the first photoboard run is cold and the second one warm.
+
+import sys
+import tempfile
+import time
+
+import topdfphoto
+from benchmarks.imageserver import image_server
+from benchmarks.photo_fetch import make_board
+from fakellm import fake_shots, fake_story
+from imagecache import ImageCache
+from scriptdata import ScriptData
+from shotdata import ShotData
+from topdfShot import generate_shot_pdf
+from topdfStory import generate_story_pdf
+from topdfphoto import generate_photoboard_pdf
+
+
+def timed(fn):
+    start = time.perf_counter()
+    pdf = fn()
+    return time.perf_counter() - start, len(pdf)
+
+
+def report(name: str, count: int, elapsed: float, size: int):
+    print(f"{name:<16} {count:>6} {elapsed:>9.2f} {elapsed / count * 1000:>10.2f} {size / 1024:>9.0f}")
+
+
+def main():
+    counts = [int(c) for c in sys.argv[1:]] or [10, 100, 1000]
+    print(f"{'generator':<16} {'items':>6} {'seconds':>9} {'ms/item':>10} {'pdf KB':>9}")
+    for count in counts:
+        story = ScriptData(**fake_story(count))
+        report("story", count, *timed(lambda: generate_story_pdf("Bench", story)))
+
+    for count in counts:
+        shots = [ShotData(**dict(shot, shot_number=i + 1)) for i, shot in enumerate(fake_shots(count, scenes=count // 10 + 1))]
+        report("shot", count, *timed(lambda: generate_shot_pdf("Bench", shots)))
+
+    with image_server(delay=0, width=1200, height=900) as base_url:
+        for count in counts:
+            board = make_board(base_url, count)
+            with tempfile.TemporaryDirectory() as cache_dir:
+                topdfphoto.image_cache = ImageCache(cache_dir)
+                report("photo, cold", count, *timed(lambda: generate_photoboard_pdf("Bench", board)))
+                report("photo, warm", count, *timed(lambda: generate_photoboard_pdf("Bench", board)))
+
+
+if __name__ == "__main__":
+    main()
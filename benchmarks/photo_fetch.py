@@ -0,0 +1,91 @@
+# python -m benchmarks.photo_fetch [shots] [delay]
+#
+# Compares the old one-by-one requests.get loop with the pooled parallel prefetch,
+# a cold image cache with a warm one, and boards that repeat images,
+# against a local image server so no network access is needed.
+
+import sys
+import tempfile
+import time
+
+import requests
+
+import imagefetch
+import topdfphoto
+from benchmarks.imageserver import image_server
+from imagecache import ImageCache
+from photodata import PhotoboardShotData
+from topdfphoto import generate_photoboard_pdf
+
+
+def make_board(base_url: str, shots: int, extra_urls=()):
+    board = []
+    for i in range(shots):
+        board.append(PhotoboardShotData(
+            shot_id=f"s{i}",
+            shot_number=i + 1,
+            scene_number=i // 10 + 1,
+            description="Marcus looks out the window at the stormy sea.",
+            style="Dramatic, low light",
+            image_url=f"{base_url}/img/{i}.jpg",
+            annotations=["Use backlight"],
+            technical_specs={
+                "shot_type": "Close-up",
+                "camera_angle": "Over-the-shoulder",
+                "camera_movement": "Static",
+                "lens_recommendation": "85mm",
+            },
+        ))
+    for i, url in enumerate(extra_urls):
+        board[i] = board[i].model_copy(update={"image_url": url})
+    return board
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:<45} {time.perf_counter() - start:8.2f}s")
+    return result
+
+
+def main():
+    shots = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+
+    with image_server(delay=delay) as base_url:
+        urls = [f"{base_url}/img/{i}.jpg" for i in range(shots)]
+        print(f"{shots} images, {delay * 1000:.0f} ms server latency, {imagefetch.FETCH_WORKERS} workers")
+
+        timed("sequential requests.get (old behaviour)", lambda: [requests.get(url).content for url in urls])
+        timed("fetch_images, 1 worker", lambda: imagefetch.fetch_images(urls, workers=1))
+        timed("fetch_images, pooled", lambda: imagefetch.fetch_images(urls))
+
+        board = make_board(base_url, shots)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            topdfphoto.image_cache = ImageCache(cache_dir)
+            pdf = timed("generate_photoboard_pdf, cold image cache", lambda: generate_photoboard_pdf("Bench", board))
+            pdf = timed("generate_photoboard_pdf, warm image cache", lambda: generate_photoboard_pdf("Bench", board))
+            print(f"{'pdf size':<45} {len(pdf) / 1024:7.0f}K")
+
+            # No cache and no downsampling, like the old full resolution re-encode
+            topdfphoto.image_cache = ImageCache(cache_dir, max_bytes=0, dpi=10000, quality=75)
+            pdf = timed("generate_photoboard_pdf, full resolution", lambda: generate_photoboard_pdf("Bench", board))
+            print(f"{'pdf size':<45} {len(pdf) / 1024:7.0f}K")
+
+            # The same three images on every shot, loaded once per document and embedded once
+            repeated = [shot.model_copy(update={"image_url": f"{base_url}/img/{i % 3}.jpg"}) for i, shot in enumerate(board)]
+            topdfphoto.image_cache = ImageCache(cache_dir, max_bytes=0)
+            pdf = timed("3 distinct images on every shot, no cache", lambda: generate_photoboard_pdf("Bench", repeated))
+            print(f"{'embedded images':<45} {pdf.count(b'/Subtype /Image'):8d}")
+
+        # One host that never answers, the board still finishes within the timeouts
+        imagefetch.FETCH_TOTAL_TIMEOUT = 3
+        board = make_board(base_url, shots, extra_urls=[f"{base_url}/hang"])
+        results = timed("fetch_images with a hung host, 3s total cap",
+                        lambda: imagefetch.fetch_images([shot.image_url for shot in board], timeout=2, total_timeout=3))
+        failed = [r for r in results.values() if r.error]
+        print(f"{'failed images (placeholders)':<45} {len(failed):8d}")
+
+
+if __name__ == "__main__":
+    main()
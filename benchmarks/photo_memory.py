@@ -0,0 +1,75 @@
+# python -m benchmarks.photo_memory [frames...]
+#
+# Peak RSS of generate_photoboard_pdf against board size, with and without the image byte ceiling
+# (PHOTOBOARD_IMAGE_BYTES). Every render runs in a fresh subprocess so the peaks don't carry over,
+# images are 2400x1600 noise JPEGs (about 3 MB each) from a local image server.
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.imageserver import image_server
+
+BUDGETS = [("no ceiling", 0), ("64 MB ceiling", 64 * 1024 * 1024), ("16 MB ceiling", 16 * 1024 * 1024)]
+
+
+def peak_rss() -> int:
+    '''Peak RSS in bytes. VmHWM starts over at exec, ru_maxrss keeps the peak of the forked parent'''
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def child(base_url: str, frames: int):
+    from benchmarks.photo_fetch import make_board
+    from topdfphoto import generate_photoboard_pdf
+
+    board = make_board(base_url, frames)
+    start = time.perf_counter()
+    pdf = generate_photoboard_pdf("Bench", board)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "seconds": elapsed,
+        "pdf_bytes": len(pdf),
+        "peak_rss": peak_rss(),
+    }))
+
+
+def run(base_url: str, frames: int, budget: int) -> dict:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, PHOTOBOARD_IMAGE_BYTES=str(budget), IMAGE_CACHE_DIR=cache_dir)
+        output = subprocess.run(
+            [sys.executable, "-W", "ignore", "-m", "benchmarks.photo_memory", "--child", base_url, str(frames)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2], int(sys.argv[3]))
+        return
+
+    counts = [int(c) for c in sys.argv[1:]] or [25, 100, 200]
+    print(f"{'frames':>7} {'mode':<15} {'seconds':>9} {'peak RSS MB':>12} {'pdf MB':>8}")
+    with image_server(delay=0, width=2400, height=1600, noise=True) as base_url:
+        for frames in counts:
+            for label, budget in BUDGETS:
+                result = run(base_url, frames, budget)
+                print(f"{frames:>7} {label:<15} {result['seconds']:>9.2f} "
+                      f"{result['peak_rss'] / 2**20:>12.0f} {result['pdf_bytes'] / 2**20:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
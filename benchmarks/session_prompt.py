@@ -0,0 +1,54 @@
+# python -m benchmarks.session_prompt [turns]
+#
+# Prompt tokens per turn of a long story refinement (patch mode) with the fake LLM backend: the client carrying
+# every earlier request in its idea, against a session_id whose older requests get summarized
+# (SESSION_TOKEN_BUDGET, SESSION_KEEP_MESSAGES). Summary calls are counted in the turn that makes them.
+
+import os
+import tempfile
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY", "0")
+os.environ.setdefault("PROJECT_STORE_PATH", os.path.join(tempfile.mkdtemp(prefix="cinespark-bench-projects-"), "projects.sqlite3"))
+
+import asyncio
+import sys
+
+import httpx
+
+import main
+from fakellm import fake_story
+from tokens import ledger
+
+
+def prompt_tokens() -> int:
+    return ledger.stats().get("/generate_story", {}).get("prompt_tokens", 0)
+
+
+async def turn(client: httpx.AsyncClient, payload: dict) -> int:
+    before = prompt_tokens()
+    response = await client.post("/generate_story", json=payload)
+    response.raise_for_status()
+    return prompt_tokens() - before
+
+
+async def run(turns: int):
+    story = fake_story(12)
+    requests = [f"Change {i + 1}: make scene {i % 12 + 1} darker, give the keeper a reason to stay and cut the epilogue"
+                for i in range(turns)]
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            print(f"{'turn':>5} {'client carried':>15} {'session':>9}")
+            for i in range(turns):
+                carried = await turn(client, {"idea": "\n".join(requests[:i + 1]), "story": story, "mode": "patch", "no_cache": True})
+                session = await turn(client, {"idea": requests[i], "story": story, "mode": "patch", "session_id": "bench", "no_cache": True})
+                print(f"{i + 1:>5} {carried:>15} {session:>9}")
+
+
+def main_cli():
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 40))
+
+
+if __name__ == "__main__":
+    main_cli()
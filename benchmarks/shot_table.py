@@ -0,0 +1,37 @@
+# python -m benchmarks.shot_table [counts...]
+#
+# Renders shot lists of growing length, time per shot should stay flat if the layout is linear.
+
+import sys
+import time
+
+from shotdata import ShotData
+from topdfShot import data, generate_shot_pdf
+
+
+def make_shots(count: int):
+    shots = []
+    for i in range(count):
+        shot = dict(data[i % len(data)])
+        shot["shot_number"] = i + 1
+        shot["scene_number"] = i // 12 + 1
+        # Keep descriptions unique so the wrap memo only helps the short columns, as on real shot lists
+        shot["description"] = f"{shot['description']} (take {i + 1})"
+        shots.append(ShotData(**shot))
+    return shots
+
+
+def main():
+    counts = [int(c) for c in sys.argv[1:]] or [100, 500, 1000, 2000]
+    print(f"{'shots':>8} {'seconds':>10} {'ms/shot':>10} {'pages':>8}")
+    for count in counts:
+        shots = make_shots(count)
+        start = time.perf_counter()
+        pdf = generate_shot_pdf("Bench", shots)
+        elapsed = time.perf_counter() - start
+        pages = pdf.count(b"/Type /Page\n")
+        print(f"{count:>8} {elapsed:>10.2f} {elapsed / count * 1000:>10.2f} {pages:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# python -m benchmarks.wire_format [shots]
+#
+# Encode and decode time and bytes on the wire for a shot list and a photoboard of 1000 shots by default.
+# Encoding compares FastAPI's default path (jsonable_encoder, then json.dumps) with orjson and MessagePack,
+# decoding compares json.loads with orjson and MessagePack, each followed by pydantic validation, and with
+# pydantic parsing the raw JSON itself. Sizes are raw, gzipped and, when brotli is installed, brotli compressed.
+
+import gzip
+import json
+import sys
+import time
+from typing import List
+
+import orjson
+import ormsgpack
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from benchmarks.photo_fetch import make_board
+from fakellm import fake_shots
+from photodata import PhotoboardShotData
+from shotdata import ShotData
+from wire import BROTLI_QUALITY, GZIP_LEVEL, brotli
+
+REPEAT = 20
+
+
+# Stand-ins for the request models, the shots in a list under one field
+class ShotBody(BaseModel):
+    items: List[ShotData]
+
+
+class PhotoBody(BaseModel):
+    items: List[PhotoboardShotData]
+
+
+def best(fn) -> float:
+    '''Fastest of REPEAT runs, in milliseconds'''
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def sizes(body: bytes) -> str:
+    compressed = f"{len(gzip.compress(body, GZIP_LEVEL)) / 1024:>9.0f}"
+    compressed += f" {len(brotli.compress(body, quality=BROTLI_QUALITY)) / 1024:>9.0f}" if brotli else f" {'-':>9}"
+    return f"{len(body) / 1024:>9.0f} {compressed}"
+
+
+def compare(name: str, payload: dict, model: type):
+    body_json = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    body_orjson = orjson.dumps(payload)
+    body_msgpack = ormsgpack.packb(payload)
+
+    print(f"\n{name}")
+    print(f"{'':<36} {'ms':>8} {'KB':>9} {'gzip KB':>9} {'br KB':>9}")
+    rows = [
+        ("encode  fastapi default", lambda: json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode("utf-8"), body_json),
+        ("encode  orjson", lambda: orjson.dumps(payload), body_orjson),
+        ("encode  msgpack", lambda: ormsgpack.packb(payload), body_msgpack),
+        ("decode  json.loads + validate", lambda: model.model_validate(json.loads(body_json)), body_json),
+        ("decode  orjson + validate", lambda: model.model_validate(orjson.loads(body_orjson)), body_orjson),
+        ("decode  msgpack + validate", lambda: model.model_validate(ormsgpack.unpackb(body_msgpack)), body_msgpack),
+        ("decode  pydantic validate_json", lambda: model.model_validate_json(body_orjson), body_orjson),
+    ]
+    for label, fn, body in rows:
+        print(f"{label:<36} {best(fn):>8.2f} {sizes(body)}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f"{count} shots, best of {REPEAT} runs" + ("" if brotli else ", brotli not installed"))
+    shots = [dict(shot, shot_number=i + 1) for i, shot in enumerate(fake_shots(count, scenes=count // 10 + 1))]
+    compare("shot list", {"items": shots}, ShotBody)
+    board = [shot.model_dump() for shot in make_board("https://images.example.com", count)]
+    compare("photoboard", {"items": board}, PhotoBody)
+
+
+if __name__ == "__main__":
+    main()
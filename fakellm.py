@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Words the fake answers are made of, only their count matters
+WORDS = (
+    "storm lighthouse keeper harbor night lantern sea rope cliff wind letter door boat fog dawn rain "
+    "silence window stairs shadow voice memory island signal engine bell tide stranger map shore"
+).split()
+SHOT_TYPES = ["Wide shot", "Medium shot", "Close-up", "Extreme close-up", "Over-the-shoulder"]
+ANGLES = ["Eye level", "Low angle", "High angle", "Dutch angle"]
+MOVEMENTS = ["Static", "Pan", "Tilt", "Dolly in", "Handheld", "Crane"]
+LENSES = ["24mm", "35mm", "50mm", "85mm", "135mm"]
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def fake_story(size: int, seed: int = 0) -> dict:
+    '''A valid ScriptData dict with `size` scenes'''
+    rng = random.Random(seed)
+    characters = [
+        {
+            "name": f"Character {i + 1}",
+            "description": sentence(rng, 12),
+            "motivation": sentence(rng, 10),
+            "arc": sentence(rng, 14),
+        }
+        for i in range(max(2, size // 4))
+    ]
+    return {
+        "logline": sentence(rng, 20),
+        "synopsis": " ".join(sentence(rng, 18) for _ in range(4)),
+        "three_act_structure": {f"act{i}": " ".join(sentence(rng, 16) for _ in range(2)) for i in (1, 2, 3)},
+        "characters": characters,
+        "scenes": [
+            {
+                "title": sentence(rng, 3).rstrip("."),
+                "setting": sentence(rng, 6),
+                "description": " ".join(sentence(rng, 15) for _ in range(2)),
+                "characters": [c["name"] for c in rng.sample(characters, 2)],
+                "key_actions": [sentence(rng, 8) for _ in range(3)],
+            }
+            for _ in range(size)
+        ],
+    }
+
+
+def fake_shots(size: int, seed: int = 0, scenes: int = 1, scene_number: Optional[int] = None) -> List[dict]:
+    '''A valid list of `size` ShotData dicts spread over `scenes` scenes'''
+    rng = random.Random(seed)
+    return [
+        {
+            "shot_number": i + 1,
+            "scene_number": scene_number or i * max(1, scenes) // size + 1,
+            "shot_type": rng.choice(SHOT_TYPES),
+            "camera_angle": rng.choice(ANGLES),
+            "camera_movement": rng.choice(MOVEMENTS),
+            "description": sentence(rng, 20),
+            "lens_recommendation": rng.choice(LENSES),
+            "estimated_duration": rng.randint(2, 12),
+            "notes": sentence(rng, 10),
+        }
+        for i in range(size)
+    ]
+
+
+class FakeChatModel(BaseChatModel):
+    '''Deterministic local stand-in for Gemini, selected with LLM_BACKEND=fake.
+
+    Tells the prompts apart by their system message and answers with valid JSON of `size` items
+    after `latency` seconds. The same messages always get the same answer.
+    '''
+
+    model: str = "fake"
+    latency: float = 0.5
+    size: int = 5
+    # Characters per chunk when streaming
+    chunk_size: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def answer(self, messages: List[BaseMessage]) -> str:
+        digest = hashlib.sha256("\n".join(str(m.content) for m in messages).encode("utf-8")).digest()
+        seed = int.from_bytes(digest[:8], "big")
+        system = str(messages[0].content) if messages else ""
+
+        if "SESSION SUMMARY" in system:
+            # Plain text, about as long whatever it summarizes
+            return " ".join(sentence(random.Random(seed), 12) for _ in range(4))
+        elif "PHOTOBOARD" in system:
+            rng = random.Random(seed)
+            body = [
+                {
+                    "shot_number": shot["shot_number"],
+                    "description": sentence(rng, 25),
+                    "style": sentence(rng, 8),
+                    "annotations": [sentence(rng, 6) for _ in range(2)],
+                }
+                for shot in json.loads(messages[2].content)
+            ]
+        elif "JSON Patch" in system:
+            body = [{"op": "replace", "path": "/logline", "value": sentence(random.Random(seed), 20)}]
+        elif "ONE scene" in system:
+            scene = json.loads(messages[2].content)
+            body = fake_shots(self.size, seed, scene_number=scene.get("scene_number", 1))
+        elif "SHOTLIST" in system:
+            story = json.loads(messages[1].content)
+            body = fake_shots(self.size, seed, scenes=len(story.get("scenes", [])))
+        else:
+            body = fake_story(self.size, seed)
+        return json.dumps(body)
+
+    def message(self, messages: List[BaseMessage], content: str) -> AIMessage:
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self.message(messages, self.answer(messages)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self.message(messages, self.answer(messages)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text = self.answer(messages)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self.message(messages, text).usage_metadata))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        text = self.answer(messages)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for chunk in chunks:
+            # Spread the latency over the answer, like tokens arriving
+            await asyncio.sleep(self.latency / len(chunks))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self.message(messages, text).usage_metadata))
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import tempfile
+import threading
+from io import BytesIO
+from typing import NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cinespark-images"))
+# Total size of the cache on disk, 0 turns it off
+IMAGE_CACHE_BYTES = int(os.getenv("IMAGE_CACHE_BYTES", str(256 * 1024 * 1024)))
+IMAGE_PRINT_DPI = int(os.getenv("IMAGE_PRINT_DPI", "150"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+# Ceiling on the image bytes embedded in one photoboard, past it frames are embedded at a lower resolution.
+# The document is built in memory, so this is what keeps very large boards inside a small instance. 0 turns it off
+PHOTOBOARD_IMAGE_BYTES = int(os.getenv("PHOTOBOARD_IMAGE_BYTES", str(64 * 1024 * 1024)))
+# Lowest resolution a frame is reduced to, it is embedded as is below that
+IMAGE_MIN_DPI = int(os.getenv("IMAGE_MIN_DPI", "40"))
+
+# Largest box a photoboard frame is printed in, see PDFPhotoboard.add_image_from_url
+PRINT_WIDTH_MM = 120
+PRINT_HEIGHT_MM = 90
+
+
+def downsample(raw: bytes, dpi: int = IMAGE_PRINT_DPI, quality: int = IMAGE_JPEG_QUALITY) -> bytes:
+    '''Decode an image and re-encode it as a JPEG no bigger than the print box at the given DPI'''
+    box = (round(PRINT_WIDTH_MM / 25.4 * dpi), round(PRINT_HEIGHT_MM / 25.4 * dpi))
+    image = Image.open(BytesIO(raw))
+    # Let the JPEG decoder skip detail we are about to throw away
+    image.draft("RGB", box)
+    image = image.convert("RGB")
+    image.thumbnail(box, Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    image.close()
+    return buffer.getvalue()
+
+
+def downsample_to_fit(jpeg: bytes, max_bytes: int, dpi: int = IMAGE_PRINT_DPI, quality: int = IMAGE_JPEG_QUALITY) -> bytes:
+    '''Re-encode a frame at lower resolutions until it takes at most max_bytes, or IMAGE_MIN_DPI is reached'''
+    while len(jpeg) > max_bytes and dpi > IMAGE_MIN_DPI:
+        dpi = max(IMAGE_MIN_DPI, int(dpi * 0.7))
+        jpeg = downsample(jpeg, dpi, quality)
+    return jpeg
+
+
+class CacheUsage(NamedTuple):
+    hits: int
+    misses: int
+    # Bytes stored
+    written: int
+    # Bytes on disk when the directory was rescanned in between, else None
+    size: Optional[int]
+
+
+class ImageCache:
+    '''Downsampled photoboard images on disk, keyed by url and optional content hash, LRU evicted by total bytes'''
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_BYTES,
+                 dpi: int = IMAGE_PRINT_DPI, quality: int = IMAGE_JPEG_QUALITY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.dpi = dpi
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+        self.scans = 0
+        # Running estimate of the bytes on disk, the directory is only rescanned once it goes over budget
+        self.size = 0
+        if self.max_bytes > 0:
+            os.makedirs(directory, exist_ok=True)
+            self.evict()
+
+    def key(self, url: str, content_hash: Optional[str] = None) -> str:
+        raw = f"{url}\0{content_hash or ''}\0{self.dpi}\0{self.quality}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path(self, url: str, content_hash: Optional[str] = None) -> str:
+        return os.path.join(self.directory, self.key(url, content_hash) + ".jpg")
+
+    def contains(self, url: str, content_hash: Optional[str] = None) -> bool:
+        return self.max_bytes > 0 and os.path.exists(self.path(url, content_hash))
+
+    def get(self, url: str, content_hash: Optional[str] = None) -> Optional[bytes]:
+        if self.max_bytes <= 0:
+            return None
+        path = self.path(url, content_hash)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # mtime is the LRU clock
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def miss(self):
+        '''Count a lookup that contains() already answered, the image is being downloaded'''
+        self.misses += 1
+
+    def put(self, url: str, raw: bytes, content_hash: Optional[str] = None) -> bytes:
+        '''Downsample a freshly downloaded image, store it and return the stored JPEG'''
+        data = downsample(raw, self.dpi, self.quality)
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return data
+        path = self.path(url, content_hash)
+        # Write then rename so other workers never read a half written file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self.size += len(data)
+        self.written += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+        return data
+
+    def evict(self):
+        '''Delete the least recently used files until the cache fits its byte budget'''
+        with self.lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(".jpg"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self.size = total
+            self.scans += 1
+
+    def snapshot(self) -> Tuple[int, int, int, int]:
+        return self.hits, self.misses, self.written, self.scans
+
+    def usage_since(self, snapshot: Tuple[int, int, int, int]) -> CacheUsage:
+        '''What this process did with the cache since an earlier snapshot()'''
+        hits, misses, written, scans = snapshot
+        return CacheUsage(self.hits - hits, self.misses - misses, self.written - written,
+                          self.size if self.scans != scans else None)
+
+    def merge(self, usage: CacheUsage):
+        '''Add what a PDF worker process did with its own copy of the cache, see pdfpool.render_payload.
+        The directory is shared, a rescan in the worker replaces the estimate of its size'''
+        self.hits += usage.hits
+        self.misses += usage.misses
+        self.written += usage.written
+        self.size = usage.size if usage.size is not None else self.size + usage.written
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.size, "max_bytes": self.max_bytes,
+                "dpi": self.dpi, "quality": self.quality}
+
+
+image_cache = ImageCache()
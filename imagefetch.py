@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from functools import lru_cache
+from io import BytesIO
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image, ImageDraw
+
+import metrics
+from logs import get_logger
+
+# Parallel downloads per photoboard, also the size of the keep-alive pool
+FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", "8"))
+# Seconds allowed for a single image, and for all images of one board
+FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", "10"))
+FETCH_TOTAL_TIMEOUT = float(os.getenv("IMAGE_FETCH_TOTAL_TIMEOUT", "60"))
+FETCH_MAX_BYTES = int(os.getenv("IMAGE_FETCH_MAX_BYTES", str(20 * 1024 * 1024)))
+# Hosts that get their own label on the fetch histogram, comma separated. Image urls come from clients,
+# every other host is counted as "other" so they can't grow the number of series without bound
+METRIC_HOSTS = frozenset(h.strip().lower() for h in os.getenv("IMAGE_FETCH_METRIC_HOSTS", "").split(",") if h.strip())
+
+log = get_logger("images")
+
+
+class FetchResult(NamedTuple):
+    url: str
+    content: Optional[bytes]
+    error: Optional[str]
+    elapsed: float
+
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    '''Shared session so every download reuses the same keep-alive connections'''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def fetch_image(url: str, timeout: float = FETCH_TIMEOUT) -> FetchResult:
+    start = time.monotonic()
+    deadline = start + timeout
+    try:
+        with get_session().get(url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            body = BytesIO()
+            # requests only times out idle sockets, check the deadline so a slow trickle can't hang us
+            for chunk in response.iter_content(64 * 1024):
+                body.write(chunk)
+                if time.monotonic() > deadline:
+                    raise requests.Timeout(f"took longer than {timeout}s")
+                if body.tell() > FETCH_MAX_BYTES:
+                    raise ValueError(f"image larger than {FETCH_MAX_BYTES} bytes")
+        result = FetchResult(url, body.getvalue(), None, time.monotonic() - start)
+    except Exception as e:
+        result = FetchResult(url, None, str(e), time.monotonic() - start)
+    host = urlsplit(url).hostname or ""
+    metrics.observe("image_fetch", result.elapsed, host=host if host in METRIC_HOSTS else "other", outcome="error" if result.error else "ok")
+    if result.error:
+        log.warning("image fetch failed", extra={"host": host, "error": result.error[:200]})
+    return result
+
+
+def fetch_and_process(url: str, timeout: float, process: Optional[Callable[[FetchResult], FetchResult]]) -> FetchResult:
+    result = fetch_image(url, timeout)
+    return process(result) if process is not None else result
+
+
+def fetch_images(urls: Iterable[str], workers: int = FETCH_WORKERS, timeout: float = FETCH_TIMEOUT,
+                 total_timeout: float = FETCH_TOTAL_TIMEOUT,
+                 process: Optional[Callable[[FetchResult], FetchResult]] = None) -> Dict[str, FetchResult]:
+    '''Download every distinct url in parallel, failures and timeouts come back as results with an error.
+
+    process runs on each result in the download thread, so a large download can be shrunk
+    before the next one starts instead of all of them being held until the end.
+    '''
+    unique = list(dict.fromkeys(urls))
+    results = {}
+    if not unique:
+        return results
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(unique))))
+    futures = {executor.submit(fetch_and_process, url, timeout, process): url for url in unique}
+    try:
+        for future in as_completed(futures, timeout=total_timeout):
+            results[futures[future]] = future.result()
+    except FuturesTimeout:
+        pass
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for url in unique:
+        if url not in results:
+            results[url] = FetchResult(url, None, f"gave up after {total_timeout}s for the whole board", total_timeout)
+    return results
+
+
+@lru_cache(maxsize=1)
+def placeholder_image() -> bytes:
+    '''Grey JPEG drawn in place of images that could not be loaded'''
+    image = Image.new("RGB", (800, 600), (220, 220, 220))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 799, 599), outline=(160, 160, 160), width=6)
+    draw.text((400, 300), "Image unavailable", fill=(90, 90, 90), anchor="mm")
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
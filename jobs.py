@@ -0,0 +1,203 @@
+import asyncio
+import contextvars
+import os
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Jobs running at once, and jobs allowed to wait for a worker before POST /jobs answers 503
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "32"))
+# Seconds a finished job and its result are kept, and how many finished jobs and bytes of PDF or ZIP results
+# are kept at most. Past either limit the jobs that finished first are dropped before their TTL
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_RESULT_MAX = int(os.getenv("JOB_RESULT_MAX", "256"))
+JOB_RESULT_BYTES = int(os.getenv("JOB_RESULT_BYTES", str(256 * 1024 * 1024)))
+
+# Job being run by the current task, lets deep code report progress without passing the job around
+current_job: ContextVar[Optional["Job"]] = ContextVar("current_job", default=None)
+
+
+def result_size(result: Any) -> int:
+    '''Bytes of a (file bytes, media type) result, JSON results are small next to those and count as 0'''
+    if isinstance(result, tuple) and result and isinstance(result[0], (bytes, bytearray)):
+        return len(result[0])
+    return 0
+
+
+def report_progress(done: int, total: int):
+    '''Update the progress of the job this code runs in, if any'''
+    job = current_job.get()
+    if job is not None and total:
+        job.progress = done / total
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind: str, fn: Callable[[], Awaitable[Any]]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fn = fn
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.progress = 0.0
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Run in the context of the request that submitted it, so metrics and token usage go to its route
+        self.context = contextvars.copy_context()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def describe(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "created": self.created,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    '''In-process job queue: a bounded number of workers, a bounded backlog, a bounded set of results kept for a while'''
+
+    def __init__(self, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE, ttl: float = JOB_RESULT_TTL,
+                 max_results: int = JOB_RESULT_MAX, max_result_bytes: int = JOB_RESULT_BYTES):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.max_results = max_results
+        self.max_result_bytes = max_result_bytes
+        self.jobs: Dict[str, Job] = {}
+        # Finished job id -> result bytes, in the order they finished
+        self.retained: "OrderedDict[str, int]" = OrderedDict()
+        self.result_bytes = 0
+        self.evicted = 0
+        # Jobs still waiting for a worker. Jobs cancelled while queued stay in the asyncio queue until a worker
+        # skips them, so its qsize() would count them against the backlog
+        self.waiting = 0
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker_tasks = []
+
+    def start(self):
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue()
+        self.worker_tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def shutdown(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        for job in self.jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+        self.queue = None
+        self.waiting = 0
+
+    def submit(self, kind: str, fn: Callable[[], Awaitable[Any]]) -> Job:
+        self.start()
+        self.purge()
+        if self.waiting >= self.queue_size:
+            raise JobQueueFull(f"{self.waiting} jobs already waiting")
+        job = Job(kind, fn)
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+        self.waiting += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.purge()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is None or job.is_finished:
+            return job
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            # Still queued, the worker skips it when it comes up
+            self.waiting -= 1
+            self.finish(job, "cancelled")
+        return job
+
+    def finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished = time.time()
+        job.fn = None
+        job.context = None
+        if status == "done":
+            job.progress = 1.0
+        size = result_size(result)
+        self.retained[job.id] = size
+        self.result_bytes += size
+        self.purge()
+
+    def purge(self):
+        '''Drop finished jobs past their TTL, then the oldest ones while over the count or byte limit'''
+        cutoff = time.time() - self.ttl
+        while self.retained:
+            job_id, size = next(iter(self.retained.items()))
+            expired = self.jobs[job_id].finished < cutoff
+            if not expired and len(self.retained) <= self.max_results and self.result_bytes <= self.max_result_bytes:
+                break
+            self.evicted += not expired
+            del self.retained[job_id]
+            del self.jobs[job_id]
+            self.result_bytes -= size
+
+    async def run(self, job: Job):
+        current_job.set(job)
+        return await job.fn()
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            if job.status != "queued":
+                continue
+            self.waiting -= 1
+            job.status = "running"
+            job.task = asyncio.create_task(self.run(job), context=job.context)
+            try:
+                result = await job.task
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    # The worker itself is being shut down
+                    raise
+                self.finish(job, "cancelled")
+            except Exception as e:
+                self.finish(job, "failed", error=getattr(e, "detail", None) or str(e) or type(e).__name__)
+            else:
+                self.finish(job, "done", result)
+            finally:
+                job.task = None
+
+    def stats(self) -> dict:
+        counts: Dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "waiting": self.waiting,
+            "jobs": counts,
+            "result_bytes": self.result_bytes,
+            "max_results": self.max_results,
+            "max_result_bytes": self.max_result_bytes,
+            "evicted": self.evicted,
+        }
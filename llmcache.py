@@ -0,0 +1,117 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    # Only for the annotations, importing langchain_core here would undo the lazy LLM stack in main.py
+    from langchain_core.messages import BaseMessage
+
+
+class LLMCache:
+    '''Content-addressed cache of model responses.
+
+    Keys are a hash of the canonical message list, so the same prompt always maps to the same entry.
+    Entries live in an in-memory LRU and, when a path is given, in a SQLite file that survives
+    restarts and is shared by every uvicorn worker pointing at it.
+    '''
+
+    def __init__(self, namespace: str, max_size: int = 1024, ttl: float = 86400, path: Optional[str] = None):
+        self.namespace = namespace
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, expires REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+
+    def key(self, messages: List["BaseMessage"]) -> str:
+        canonical = json.dumps(
+            [self.namespace] + [[m.type, m.content] for m in messages],
+            sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                content, expires = entry
+                if expires > now:
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return content
+                del self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT content, expires FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    self.db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[0]
+                if row is not None:
+                    self.db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, content: str):
+        now = time.time()
+        expires = now + self.ttl
+        with self.lock:
+            self._remember(key, content, expires)
+            self.stores += 1
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, content, expires, last_used) VALUES (?, ?, ?, ?)",
+                    (key, content, expires, now),
+                )
+                # Drop expired rows, then the least recently used ones above max_size
+                self.db.execute("DELETE FROM llm_cache WHERE expires <= ?", (now,))
+                self.db.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,),
+                )
+
+    def discard(self, key: str):
+        '''Forget an entry, used when the cached response turned out to be unusable'''
+        with self.lock:
+            self.memory.pop(key, None)
+            if self.db is not None:
+                self.db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "memory_entries": len(self.memory),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "persistent": self.db is not None,
+        }
+
+    def _remember(self, key, content, expires):
+        self.memory[key] = (content, expires)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
@@ -1,238 +1,107 @@
 # python -m uvicorn main:app --reload
 
-from fastapi import FastAPI, Request
-from fastapi.responses import FileResponse
+import time
+# Startup is timed from here, see cinespark_startup_seconds
+IMPORT_START = time.perf_counter()
+
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from langgraph.graph import StateGraph, END
-from typing import List, TypedDict, Dict
+from typing import List, Literal, Optional, Tuple
 from dotenv import load_dotenv
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-import json
-import re
 from pydantic import BaseModel
 
-import uuid
-import tempfile
 import os
+import asyncio
+import importlib
+from types import ModuleType
 from scriptdata import ScriptData
 from shotdata import ShotData
-from topdfStory import generate_story_pdf
-from topdfShot import generate_shot_pdf
-from topdfphoto import generate_photoboard_pdf
 from photodata import PhotoboardShotData
+from storystream import StoryStreamParser, sse_event
+from structured import parse_structured, StructuredOutputError, outcome_stats
+from singleflight import SingleFlight, flight_key
+import metrics
+from logs import get_logger
+from tokens import ledger, current_route, check_prompt_size, usage_tokens, PromptTooLarge
+from pdfcache import RenderCache, render_key, etag_matches
+from imagecache import image_cache
+from pdfpool import PDFPool, PoolBusy
+from pdfbundle import merge_pdfs, zip_pdfs, safe_filename
+from jobs import JobQueue, JobQueueFull
+from projectstore import ProjectStore, NotFound, Document
+from wire import WireResponse, WireRoute, CompressionMiddleware, read_body, response_format
+import orjson
+from pydantic import TypeAdapter, ValidationError
+from contextlib import asynccontextmanager
 
 load_dotenv()
 
-class AgentState(TypedDict):
-    story:dict
-    idea:List[HumanMessage]
-    shot:List[dict]
-    photo: str
-    finish:bool
-
-
-
-model = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
-
-
-#########################CREATE STORY##########################################################
-def create_story_node(state : AgentState) -> AgentState:
-    '''A story node that gneerate a story based on the user story idea'''
-
-    system_prompt = SystemMessage(content="""
-   You are a professional story and film development assistant.
-
-    Your task is to respond with a valid JSON object **only**, no explanations or text outside of the JSON.
-
-    The expected structure:
-    {
-    "logline": "string",
-    "synopsis": "string",
-    "three_act_structure": {
-        "act1": "string",
-        "act2": "string",
-        "act3": "string"
-    },
-    "characters": [
-        {
-        "name": "string",
-        "description": "string",
-        "motivation": "string",
-        "arc": "string"
-        }
-    ],
-    "scenes": [
-        {
-        "title": "string",
-        "setting": "string",
-        "description": "string",
-        "characters": ["string"],
-        "key_actions": ["string"]
-        }
-    ]
-    }
-    Respond only with this JSON.
-    """)
-
-    story_message = HumanMessage(content=json.dumps(state["story"], indent=2))
-    all_messages = [system_prompt, story_message]
-    all_messages += state["idea"]
-
-    # all_messages = [system_prompt] + list(state["story"]) +  state["idea"]
-
-    response = model.invoke(all_messages)
-
-    raw_output = response.content.strip()
-
-    # Remove triple backticks and `json` label if present
-    raw_output = re.sub(r"^```json\s*", "", raw_output)
-    raw_output = re.sub(r"```$", "", raw_output)
-
-    try:
-        parsed_story = json.loads(raw_output)
-    except json.JSONDecodeError:
-        parsed_story = {"error": "Failed to parse AI response as JSON", "raw": response.content}
-
-    state['story'] = parsed_story
-
-    print(f"\n🤖 AI: {parsed_story}")
-
-    return state
-
-graph = StateGraph(AgentState)
-
-graph.add_node("story_generator", create_story_node)
-graph.set_entry_point('story_generator')
-graph.add_edge('story_generator', END)
-graph_story = graph.compile()
-
-#########################CREATE SHOT##########################################################
-
-def create_shot_node(state : AgentState) -> AgentState:
-    '''A shot node that gneerate a shhot based on the user story'''
-
-    system_prompt = SystemMessage(content="""
-    You are a professional Director of Photography.
-
-    Your job is to create a SHOTLIST in JSON format based on the following story.
-
-    Your task is to respond with a valid JSON object **only**, no explanations or text outside of the JSON.
-
-    The expected structure:
-        [
-    {
-        "shot_number": 0,
-        "scene_number": 0,
-        "shot_type": "string",
-        "camera_angle": "string",
-        "camera_movement": "string",
-        "description": "string",
-        "lens_recommendation": "string",
-        "estimated_duration": 0,
-        "notes": "string"
-    },
-    {
-        "shot_number": 0,
-        "scene_number": 0,
-        "shot_type": "string",
-        "camera_angle": "string",
-        "camera_movement": "string",
-        "description": "string",
-        "lens_recommendation": "string",
-        "estimated_duration": 0,
-        "notes": "string"
-    }
-    ]
-    Respond only with this JSON.
-
-    Please generate 5 well-thought-out shots.
-    
-    """)
-
-    story_message = HumanMessage(content=json.dumps(state["story"], indent=2))
-    shot_message = HumanMessage(content=json.dumps(state["shot"], indent=2)) if state["shot"] else None
-    all_messages = [system_prompt, story_message]
-    if shot_message:
-        all_messages.append(shot_message)
-    all_messages += state["idea"]
-    # all_messages = [system_prompt] + list(state["story"]) + [state["shot"]] + state["idea"]
-
-    response = model.invoke(all_messages)
-
-    raw_output = response.content.strip()
+log = get_logger("api")
 
-    # Remove triple backticks and `json` label if present
-    raw_output = re.sub(r"^```json\s*", "", raw_output)
-    raw_output = re.sub(r"```$", "", raw_output)
 
-    try:
-        parsed_shot = json.loads(raw_output)
-    except json.JSONDecodeError:
-        parsed_shot = {"error": "Failed to parse AI response as JSON", "raw": response.content}
-
-    state['shot'] = parsed_shot
-
-    print(f"\n🤖 AI: {parsed_shot}")
-
-    return state
-
-
-
-graph = StateGraph(AgentState)
+##################----LLM STACK---#############
+# langchain, langgraph and the Gemini client take seconds to import, the PDF routes don't need them.
+# storygraphs.py holds all of it and is imported in a thread once the app starts, the LLM routes wait for it.
+llm_loading: Optional[asyncio.Future] = None
 
-graph.add_node("shot_generator", create_shot_node)
-graph.set_entry_point('shot_generator')
-graph.add_edge('shot_generator', END)
-graph_shot = graph.compile()
+def load_llm_stack() -> ModuleType:
+    start = time.perf_counter()
+    module = importlib.import_module("storygraphs")
+    metrics.STARTUP_TIME.labels(phase="llm_stack").set(time.perf_counter() - start)
+    log.info("llm stack loaded", extra={"seconds": round(time.perf_counter() - start, 3)})
+    return module
 
+def start_llm_loading() -> asyncio.Future:
+    global llm_loading
+    # A failed import is retried by the next request instead of failing every request after it
+    if llm_loading is None or (llm_loading.done() and llm_loading.exception() is not None):
+        llm_loading = asyncio.ensure_future(asyncio.to_thread(load_llm_stack))
+    return llm_loading
 
-###############--PHOTOBOARD GENERATION--##################
-def create_photo_node(state : AgentState) -> AgentState:
-    '''A photboard node that gneerate a photboard based on the user shotlist'''
+async def llm_stack() -> ModuleType:
+    return await asyncio.shield(start_llm_loading())
 
-    system_prompt = SystemMessage(content="""
-    You are a professional Director of Photography.
+def llm_stack_if_loaded() -> Optional[ModuleType]:
+    if llm_loading is not None and llm_loading.done() and llm_loading.exception() is None:
+        return llm_loading.result()
+    return None
 
-    Your job is to create a PHOTO based on the following shot.
-    
-    """)
-
-    all_messages = [system_prompt] + [AIMessage(content=state["shot"])]
-
-    response = model.invoke(all_messages)
-
-    raw_output = response.content.strip()
+#################-FASTAPI-########################
 
-    # Remove triple backticks and `json` label if present
-    raw_output = re.sub(r"^```json\s*", "", raw_output)
-    raw_output = re.sub(r"```$", "", raw_output)
+# PDF rendering is CPU bound, it runs in a pool so it never holds up the event loop
+pdf_pool = PDFPool()
+# Long generations and exports can also run as jobs, see /jobs below
+job_queue = JobQueue()
 
+async def warm_pdf_pool():
+    start = time.perf_counter()
     try:
-        parsed_shot = json.loads(raw_output)
-    except json.JSONDecodeError:
-        parsed_shot = {"error": "Failed to parse AI response as JSON", "raw": response.content}
-
-    state['shot'] = parsed_shot
-
-    print(f"\n🤖 AI: {parsed_shot}")
-
-    return state
-
-
-
-graph = StateGraph(AgentState)
-
-graph.add_node("shot_generator", create_shot_node)
-graph.set_entry_point('shot_generator')
-graph.add_edge('shot_generator', END)
-graph_shot = graph.compile()
-
-
-
-#################-FASTAPI-########################
-
-app = FastAPI()
+        await pdf_pool.start()
+    except Exception as e:
+        # Renders start the pool themselves, a failed warm-up only makes the first one wait for it
+        log.warning("pdf pool warm-up failed", extra={"error": str(e)})
+        return
+    metrics.STARTUP_TIME.labels(phase="pdf_pool").set(time.perf_counter() - start)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    metrics.STARTUP_TIME.labels(phase="import").set(APP_IMPORTED - IMPORT_START)
+    # Neither is awaited, the app starts serving while the LLM stack loads and the PDF workers spawn.
+    # A render that comes before the workers are up just queues for the first free one
+    start_llm_loading()
+    pdf_warming = asyncio.ensure_future(warm_pdf_pool())
+    metrics.STARTUP_TIME.labels(phase="ready").set(time.perf_counter() - IMPORT_START)
+    log.info("ready", extra={"seconds": round(time.perf_counter() - IMPORT_START, 3)})
+    job_queue.start()
+    yield
+    pdf_warming.cancel()
+    await job_queue.shutdown()
+    pdf_pool.shutdown()
+
+# JSON through orjson, MessagePack bodies and responses for clients that send or accept application/msgpack
+app = FastAPI(lifespan=lifespan, default_response_class=WireResponse)
+app.router.route_class = WireRoute
 
 # Allow local frontend to access backend
 app.add_middleware(
@@ -242,90 +111,528 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# gzip, or brotli when it is installed, for everything but PDFs, archives and event streams
+app.add_middleware(CompressionMiddleware)
+
+# Book LLM token usage against the route that caused it, and time every request by its route template
+# (for streamed responses that is the time to the first byte)
+@app.middleware("http")
+async def route_context(request: Request, call_next):
+    current_route.set(request.url.path)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.REQUEST_LATENCY.labels(
+            route=route.path if route else "unmatched", method=request.method, status=str(status)
+        ).observe(time.perf_counter() - start)
+
+@app.exception_handler(PromptTooLarge)
+async def prompt_too_large(request: Request, exc: PromptTooLarge):
+    return JSONResponse(status_code=413, content={"detail": str(exc), "estimated_tokens": exc.estimated, "limit": exc.limit})
+
+##################----PROJECTS---#############
+# Stories, shot lists and photoboards can live server side, every save is a new version (see /projects below).
+# Generation and PDF requests then name a project_id, and optionally a story_version, shot_version or photo_version,
+# instead of carrying the documents in their body. A document given inline still takes precedence.
+project_store = ProjectStore()
+
+@app.exception_handler(NotFound)
+async def project_not_found(request: Request, exc: NotFound):
+    return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+async def stored_document(request, kind: str, required: bool = True) -> Optional[Document]:
+    '''The stored version of a document that a request names, None when it names no project'''
+    if request.project_id is None:
+        return None
+    version = getattr(request, f"{kind}_version")
+    try:
+        return await asyncio.to_thread(project_store.get, request.project_id, kind, version)
+    except NotFound:
+        # A project without the document yet is fine when it is optional, a version that doesn't exist never is
+        if required or version is not None:
+            raise
+        return None
+
+async def require_project(request):
+    '''404 for an unknown project before anything is generated, not once the result can't be saved'''
+    if request.project_id is not None:
+        await asyncio.to_thread(project_store.require, request.project_id)
+
+async def save_result(request, kind: str, data) -> dict:
+    '''Save a generation result as the next version of the request's project, returns the fields to add to the answer'''
+    if request.project_id is None:
+        return {}
+    try:
+        document = await asyncio.to_thread(project_store.put, request.project_id, kind, data)
+    except ValidationError as e:
+        log.warning("result not saved", extra={"project_id": request.project_id, "kind": kind, "error": str(e)})
+        return {"project_id": request.project_id, "version": None}
+    return {"project_id": request.project_id, "version": document.version}
+
+async def request_document(request, kind: str, inline, required: bool = False):
+    '''A document for a generation: inline, else stored in the request's project, else the one its session carries'''
+    if inline:
+        return inline
+    stored = await stored_document(request, kind, required=required and request.session_id is None)
+    if stored is not None:
+        return stored.data.model_dump() if kind == "story" else [item.model_dump() for item in stored.data]
+    if request.session_id is not None:
+        llm = await llm_stack()
+        value = (await llm.session_values(request.session_id)).get(kind)
+        # A failed generation leaves an {"error", "raw"} object in place of the document, shot lists and photoboards are lists
+        if value and ("error" not in value if kind == "story" else isinstance(value, list)):
+            return value
+    if required:
+        raise HTTPException(status_code=422, detail=f"{kind}, project_id or a session_id that has one is required")
+    return {} if kind == "story" else []
 
 # Call the model to generate the story, if the story already exist, than idea is treated as a suggestion from user
 # If story not exist yet, then story is parse in as empty string
 class StoryRequest(BaseModel):
     idea: str
     story: dict = {}
+    # Refine the stored story instead, the result is saved as its next version
+    project_id: Optional[str] = None
+    story_version: Optional[int] = None
+    # Run as the next turn of this conversation, see SESSIONS in storygraphs.py. Any id the client picks
+    session_id: Optional[str] = None
+    no_cache: bool = False
+    # "patch" refines an existing story through a JSON Patch instead of regenerating all of it
+    mode: Literal["full", "patch"] = "full"
+
 
+# Identical requests that arrive while the first one is still running wait for it instead of calling Gemini again
+generation_flights = SingleFlight()
 
+# The generation routes return WireResponse themselves, a large shot list would otherwise go through jsonable_encoder
 @app.post("/generate_story")
 async def generate_story(request: StoryRequest):
-    state = {
-        'idea': [HumanMessage(content=request.idea)],
-        'story': request.story,
-        'shot': "",
-        'finish': False
+    return WireResponse(await story_flight(request))
+
+def story_flight(request: StoryRequest):
+    return generation_flights.do(flight_key("/generate_story", request), lambda: run_story(request))
+
+async def run_story(request: StoryRequest):
+    await require_project(request)
+    llm = await llm_stack()
+    # A project or a session without a story yet starts one
+    story = await request_document(request, "story", request.story)
+    state = llm.initial_state(request.idea, story, no_cache=request.no_cache)
+    if request.mode == "patch" and story:
+        state['patch'] = None
+        state['errors'] = []
+        result = await llm.invoke(llm.graph_story_patch, state, request.session_id)
+        return {
+        "story": result["story"],
+        "patch": result["patch"],
+        "errors": result["errors"],
+        **await save_result(request, "story", result["story"]),
     }
-    result = graph_story.invoke(state)
+    result = await llm.invoke(llm.graph_story, state, request.session_id)
     return {
-    "story": result["story"] 
+    "story": result["story"],
+    **await save_result(request, "story", result["story"]),
 }
 
+# Same as /generate_story but streamed as Server-Sent Events, every top-level field of the story
+# (logline, synopsis, each act, each character, each scene) is sent as soon as the model has finished writing it.
+# The last event is either "story" with the full parsed story or "error", followed by "saved"
+# with the new version when the request names a project.
+@app.post("/generate_story/stream")
+async def generate_story_stream(request: StoryRequest):
+    if request.session_id is not None:
+        raise HTTPException(status_code=422, detail="session_id is not supported when streaming, use /generate_story")
+    await require_project(request)
+    llm = await llm_stack()
+    state = llm.initial_state(request.idea, await request_document(request, "story", request.story), no_cache=request.no_cache)
+    all_messages = llm.build_story_messages(state)
+
+    llm_cache = llm.llm_cache
+    key = llm_cache.key(all_messages)
+    # Checked before the response starts, a 413 can't be sent once the stream is open
+    prompt_estimate = check_prompt_size(all_messages)
+
+    async def events():
+        parser = StoryStreamParser()
+        cached = None if request.no_cache else await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            ledger.record(0, 0, cached=True)
+            for event, data in parser.feed(cached):
+                yield sse_event(event, data)
+        else:
+            kwargs = {"generation_config": llm.json_generation_config} if llm.LLM_JSON_MODE else {}
+            usage = None
+            try:
+                async with llm.llm_semaphore:
+                    with metrics.LLM_IN_FLIGHT.track_inprogress(), metrics.timer(metrics.LLM_LATENCY, mode="stream"):
+                        async for chunk in llm.model.astream(all_messages, **kwargs):
+                            usage = chunk if getattr(chunk, "usage_metadata", None) else usage
+                            for event, data in parser.feed(chunk.content):
+                                yield sse_event(event, data)
+            except Exception as e:
+                # The response has started, the failure can only be told as the last event
+                log.warning("story stream failed", extra={"error": str(e)[:200]})
+                yield sse_event("error", {"error": f"Story generation failed: {str(e)[:200] or type(e).__name__}", "raw": parser.buf})
+                return
+            finally:
+                ledger.record(*usage_tokens(usage, prompt_estimate, parser.buf))
+        try:
+            story = parse_structured(parser.buf, llm.story_adapter)
+        except StructuredOutputError as e:
+            llm_cache.discard(key)
+            yield sse_event("error", {"error": f"Failed to parse AI response as JSON: {e}", "raw": e.raw})
+            return
+        if cached is None:
+            await asyncio.to_thread(llm_cache.set, key, parser.buf)
+        yield sse_event("story", story)
+        if request.project_id is not None:
+            yield sse_event("saved", await save_result(request, "story", story))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 #Idea acts ad suggestion, story is in JSON Format
 class ShotRequest(BaseModel):
     idea: str = " "
-    story: dict
+    # Required unless project_id or session_id is given
+    story: dict = {}
     shot: List = []
+    project_id: Optional[str] = None
+    story_version: Optional[int] = None
+    shot_version: Optional[int] = None
+    session_id: Optional[str] = None
+    no_cache: bool = False
+    # One call per scene instead of one for the whole story, failed scenes are listed in "errors"
+    per_scene: bool = False
 
 @app.post("/generate_shot")
 async def generate_shot(request : ShotRequest):
-    state = {
-    'idea': [HumanMessage(content=request.idea)],
-    'story': request.story,   
-    'shot': request.shot,    
-    'finish': False 
-    } 
-    result = graph_shot.invoke(state)
-    return {"shot" : result["shot"]}
+    return WireResponse(await shot_flight(request))
+
+def shot_flight(request : ShotRequest):
+    return generation_flights.do(flight_key("/generate_shot", request), lambda: run_shot(request))
+
+async def run_shot(request : ShotRequest):
+    await require_project(request)
+    story = await request_document(request, "story", request.story, required=True)
+    shot = await request_document(request, "shot", request.shot)
+    llm = await llm_stack()
+    state = llm.initial_state(request.idea, story, shot, no_cache=request.no_cache)
+    if request.per_scene:
+        result = await llm.invoke(llm.graph_shot_scenes, state, request.session_id)
+        return {"shot" : result["shot"], "errors": result["errors"], **await save_result(request, "shot", result["shot"])}
+    result = await llm.invoke(llm.graph_shot, state, request.session_id)
+    return {"shot" : result["shot"], **await save_result(request, "shot", result["shot"])}
+
+# Photoboard entries for a shot list, several shots per model call. The story is optional context,
+# image_url is left empty for the frontend to fill, shots whose batch failed are listed in "errors"
+class PhotoRequest(BaseModel):
+    idea: str = " "
+    story: dict = {}
+    # Required unless project_id or session_id is given
+    shot: List[ShotData] = []
+    project_id: Optional[str] = None
+    story_version: Optional[int] = None
+    shot_version: Optional[int] = None
+    session_id: Optional[str] = None
+    no_cache: bool = False
+
+@app.post("/generate_photo")
+async def generate_photo(request : PhotoRequest):
+    return WireResponse(await photo_flight(request))
+
+def photo_flight(request : PhotoRequest):
+    return generation_flights.do(flight_key("/generate_photo", request), lambda: run_photo(request))
+
+async def run_photo(request : PhotoRequest):
+    await require_project(request)
+    shot = await request_document(request, "shot", [s.model_dump() for s in request.shot], required=True)
+    story = await request_document(request, "story", request.story)
+    llm = await llm_stack()
+    state = llm.initial_state(request.idea, story, shot, no_cache=request.no_cache)
+    result = await llm.invoke(llm.graph_photo, state, request.session_id)
+    return {"photo": result["photo"], "errors": result["errors"], **await save_result(request, "photo", result["photo"])}
 
 
 ##################----GENERATE PDF Story---#############
+# Rendered PDFs are kept by a hash of the validated payload, so re-downloading an unchanged project is free
+render_cache = RenderCache(max_bytes=int(os.getenv("PDF_CACHE_BYTES", str(64 * 1024 * 1024))))
+
+async def render_cached(kind: str, project_name: str, data, key: str = None) -> Tuple[bytes, bool]:
+    '''Return a PDF from the render cache, rendering it in the pool on a miss, and whether it is complete.
+    A photoboard with images that failed to load is not cached, the next request tries them again'''
+    key = key or render_key(kind, project_name, data)
+    pdf = render_cache.get(key)
+    if pdf is not None:
+        return pdf, True
+    try:
+        pdf, complete = await pdf_pool.render(kind, project_name, data)
+    except PoolBusy:
+        raise HTTPException(status_code=503, detail="PDF renderer is busy, retry shortly", headers={"Retry-After": "1"})
+    if complete:
+        render_cache.set(key, pdf)
+    return pdf, complete
+
+async def pdf_document(data, kind: str) -> Tuple[str, object, str]:
+    '''(project name, document, render key) of a PDF request, stored documents are keyed by their content hash'''
+    inline = getattr(data, kind)
+    if inline is not None:
+        if data.project_name is None:
+            raise HTTPException(status_code=422, detail="project_name is required with an inline document")
+        return data.project_name, inline, render_key(kind, data.project_name, inline)
+    if data.project_id is None:
+        raise HTTPException(status_code=422, detail=f"{kind} or project_id is required")
+    document = await stored_document(data, kind)
+    project_name = data.project_name or document.project_name
+    return project_name, document.data, render_key(kind, project_name, {"sha256": document.hash})
+
+async def cached_pdf_response(request: Request, kind: str, data) -> Response:
+    '''Serve a PDF from the render cache, rendering it on a miss, and answer 304 when the client already has it'''
+    project_name, document, key = await pdf_document(data, kind)
+    etag = f'"{key}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    pdf, complete = await render_cached(kind, project_name, document, key)
+
+    # An incomplete render gets no ETag, a revalidation would otherwise keep the placeholders on the client
+    return Response(pdf, media_type="application/pdf", headers={
+        **({"ETag": etag} if complete else {"Cache-Control": "no-store"}),
+        "Content-Disposition": f'attachment; filename="{key[:32]}.pdf"',
+    })
+
+# Each PDF request takes its document inline with a project_name, or a project_id (the name defaults to the project's)
 class PDFStoryRequest(BaseModel):
-    project_name: str
-    story: ScriptData
+    project_name: Optional[str] = None
+    story: Optional[ScriptData] = None
+    project_id: Optional[str] = None
+    story_version: Optional[int] = None
 
 @app.post("/generate-pdf-story")
-async def generate_pdf_story(data : PDFStoryRequest) -> FileResponse:
-    temp_dir = tempfile.gettempdir()  
-    filename = f"{uuid.uuid4().hex}.pdf"
-    filepath = os.path.join(temp_dir, filename)
-
-    generate_story_pdf(data.project_name, data.story, filepath)
-    return FileResponse(filepath, filename=filename, media_type="application/pdf")
+async def generate_pdf_story(data : PDFStoryRequest, request: Request) -> Response:
+    return await cached_pdf_response(request, "story", data)
 
 ##################----GENERATE PDF Shot---#############
 class PDFShotRequest(BaseModel):
-    project_name: str
-    shot: List[ShotData]
+    project_name: Optional[str] = None
+    shot: Optional[List[ShotData]] = None
+    project_id: Optional[str] = None
+    shot_version: Optional[int] = None
 
 @app.post("/generate-pdf-shot")
-async def generate_pdf_shot(data : PDFShotRequest) -> FileResponse:
-    temp_dir = tempfile.gettempdir()  
-    filename = f"{uuid.uuid4().hex}.pdf"
-    filepath = os.path.join(temp_dir, filename)
+async def generate_pdf_shot(data : PDFShotRequest, request: Request) -> Response:
+    return await cached_pdf_response(request, "shot", data)
+
+
+##################----METRICS---#############
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render_latest()
+    return Response(body, media_type=content_type)
 
-    generate_shot_pdf(data.project_name, data.shot, filepath)
-    return FileResponse(filepath, filename=filename, media_type="application/pdf")
 
+##################----STATS---#############
+@app.get("/stats")
+async def stats():
+    llm = llm_stack_if_loaded()
+    return {"llm_cache": llm.llm_cache.stats() if llm else None, "sessions": llm.checkpointer.stats() if llm else None, "render_cache": render_cache.stats(), "image_cache": image_cache.stats(), "pdf_pool": pdf_pool.stats(), "structured_output": outcome_stats(), "tokens": ledger.stats(), "single_flight": generation_flights.stats(), "jobs": job_queue.stats(), "project_store": project_store.stats()}
 
-print("loading")
 
 ##################----GENERATE PDF Photboard---#############
 class PDFPhotoRequest(BaseModel):
-    project_name: str
-    photo: List[PhotoboardShotData]
+    project_name: Optional[str] = None
+    photo: Optional[List[PhotoboardShotData]] = None
+    project_id: Optional[str] = None
+    photo_version: Optional[int] = None
 
 @app.post("/generate-pdf-photo")
-async def generate_pdf_photo(data : PDFPhotoRequest) -> FileResponse:
-    temp_dir = tempfile.gettempdir()  
-    filename = f"{uuid.uuid4().hex}.pdf"
-    filepath = os.path.join(temp_dir, filename)
-
-    generate_photoboard_pdf(data.project_name, data.photo, filepath)
-    return FileResponse(filepath, filename=filename, media_type="application/pdf")
-
+async def generate_pdf_photo(data : PDFPhotoRequest, request: Request) -> Response:
+    return await cached_pdf_response(request, "photo", data)
+
+
+##################----GENERATE PDF Bundle---#############
+# Story, shot list and photoboard in one request. The three documents render concurrently
+# (and share the render cache with the single endpoints), then come back merged or zipped.
+class PDFBundleRequest(BaseModel):
+    project_name: Optional[str] = None
+    story: Optional[ScriptData] = None
+    shot: Optional[List[ShotData]] = None
+    photo: Optional[List[PhotoboardShotData]] = None
+    format: Literal["pdf", "zip"] = "pdf"
+    project_id: Optional[str] = None
+    story_version: Optional[int] = None
+    shot_version: Optional[int] = None
+    photo_version: Optional[int] = None
+
+async def bundle_documents(data: PDFBundleRequest):
+    '''pdf_document of the story, the shot list and the photoboard'''
+    return await asyncio.gather(*[pdf_document(data, kind) for kind in ("story", "shot", "photo")])
+
+async def render_bundle(data: PDFBundleRequest, documents=None):
+    documents = documents or await bundle_documents(data)
+    (story_pdf, _), (shot_pdf, _), (photo_pdf, complete) = await asyncio.gather(*[
+        render_cached(kind, project_name, document, key)
+        for kind, (project_name, document, key) in zip(("story", "shot", "photo"), documents)
+    ])
+
+    name = safe_filename(documents[0][0])
+    if data.format == "zip":
+        body = await asyncio.to_thread(zip_pdfs, [
+            (f"{name} - Story.pdf", story_pdf),
+            (f"{name} - Shot List.pdf", shot_pdf),
+            (f"{name} - Photoboard.pdf", photo_pdf),
+        ])
+        media_type = "application/zip"
+    else:
+        body = await asyncio.to_thread(merge_pdfs, [
+            ("Story", story_pdf),
+            ("Shot List", shot_pdf),
+            ("Photoboard", photo_pdf),
+        ])
+        media_type = "application/pdf"
+    return body, media_type, complete
+
+@app.post("/generate-pdf-bundle")
+async def generate_pdf_bundle(data : PDFBundleRequest, request: Request) -> Response:
+    documents = await bundle_documents(data)
+    # The keys of the three documents already cover their content
+    key = render_key(f"bundle-{data.format}", documents[0][0], [key for _, _, key in documents])
+    etag = f'"{key}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    body, media_type, complete = await render_bundle(data, documents)
+    name = safe_filename(documents[0][0])
+    return Response(body, media_type=media_type, headers={
+        **({"ETag": etag} if complete else {"Cache-Control": "no-store"}),
+        "Content-Disposition": f'attachment; filename="{name}.{data.format}"',
+    })
+
+
+##################----JOBS---#############
+# Same work as the endpoints above, but POST /jobs/{kind} answers right away with a job id,
+# so long photoboards and scene-parallel shot lists don't run into proxy timeouts.
+# Poll GET /jobs/{id}, then fetch GET /jobs/{id}/result. Results expire after JOB_RESULT_TTL seconds,
+# or sooner when more than JOB_RESULT_MAX jobs or JOB_RESULT_BYTES of files are kept.
+async def pdf_job(kind: str, data):
+    project_name, document, key = await pdf_document(data, kind)
+    pdf, _ = await render_cached(kind, project_name, document, key)
+    return pdf, "application/pdf"
+
+async def bundle_job(data: PDFBundleRequest):
+    body, media_type, _ = await render_bundle(data)
+    return body, media_type
+
+# Job kind -> (body schema, coroutine), a coroutine returns JSON or (file bytes, media type)
+JOB_KINDS = {
+    "story": (TypeAdapter(StoryRequest), lambda data: story_flight(data)),
+    "shot": (TypeAdapter(ShotRequest), lambda data: shot_flight(data)),
+    "photo": (TypeAdapter(PhotoRequest), lambda data: photo_flight(data)),
+    "pdf-story": (TypeAdapter(PDFStoryRequest), lambda data: pdf_job("story", data)),
+    "pdf-shot": (TypeAdapter(PDFShotRequest), lambda data: pdf_job("shot", data)),
+    "pdf-photo": (TypeAdapter(PDFPhotoRequest), lambda data: pdf_job("photo", data)),
+    "pdf-bundle": (TypeAdapter(PDFBundleRequest), lambda data: bundle_job(data)),
+}
 
-print("loading")
+def job_or_404(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
 
+@app.post("/jobs/{kind}", status_code=202)
+async def submit_job(kind: Literal["story", "shot", "photo", "pdf-story", "pdf-shot", "pdf-photo", "pdf-bundle"], request: Request):
+    adapter, run = JOB_KINDS[kind]
+    body = await read_body(request)
+    try:
+        data = adapter.validate_json(body) if isinstance(body, bytes) else adapter.validate_python(body)
+    except ValidationError as e:
+        # The input of a malformed body is the raw bytes, which can't go into a JSON answer
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False, include_input=False))
+    try:
+        job = job_queue.submit(kind, lambda: run(data))
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full, retry shortly", headers={"Retry-After": "5"})
+    return {**job.describe(), "status_url": f"/jobs/{job.id}", "result_url": f"/jobs/{job.id}/result"}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = job_or_404(job_id)
+    status = job.describe()
+    # JSON results come inline, files through /result
+    if job.status == "done" and not isinstance(job.result, tuple):
+        status["result"] = job.result
+    return WireResponse(status)
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = job_or_404(job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    if not isinstance(job.result, tuple):
+        return WireResponse(job.result)
+    body, media_type = job.result
+    extension = "zip" if media_type == "application/zip" else "pdf"
+    return Response(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{job.kind}-{job.id}.{extension}"',
+    })
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job_or_404(job_id)
+    return job_queue.cancel(job_id).describe()
+
+
+
+##################----PROJECTS---#############
+# Create a project, PUT its story, shot list or photoboard (each PUT is a new version, an unchanged document
+# keeps its version), then refer to it by project_id in the routes above. GET answers 304 on a matching ETag.
+ProjectKind = Literal["story", "shot", "photo"]
+
+class ProjectRequest(BaseModel):
+    name: str
+
+@app.post("/projects", status_code=201)
+async def create_project(request: ProjectRequest):
+    return await asyncio.to_thread(project_store.create, request.name)
+
+@app.get("/projects/{project_id}")
+async def get_project(project_id: str):
+    return await asyncio.to_thread(project_store.project, project_id)
+
+@app.delete("/projects/{project_id}")
+async def delete_project(project_id: str):
+    await asyncio.to_thread(project_store.delete, project_id)
+    return {"id": project_id, "deleted": True}
+
+@app.put("/projects/{project_id}/{kind}")
+async def save_project_document(project_id: str, kind: ProjectKind, request: Request):
+    try:
+        document = await asyncio.to_thread(project_store.put, project_id, kind, await read_body(request))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False, include_input=False))
+    return {"project_id": project_id, "kind": kind, "version": document.version, "hash": document.hash}
+
+@app.get("/projects/{project_id}/{kind}/versions")
+async def project_document_versions(project_id: str, kind: ProjectKind):
+    return await asyncio.to_thread(project_store.versions, project_id, kind)
+
+@app.get("/projects/{project_id}/{kind}")
+async def get_project_document(project_id: str, kind: ProjectKind, request: Request, version: Optional[int] = None):
+    # Served as stored, no parsing or validation
+    document = await asyncio.to_thread(project_store.content, project_id, kind, version)
+    etag = f'"{document.hash}"'
+    headers = {"ETag": etag, "X-Document-Version": str(document.version)}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if response_format.get() == "msgpack":
+        return WireResponse(orjson.loads(document.data), headers=headers)
+    return Response(document.data, media_type="application/json", headers=headers)
+
+
+APP_IMPORTED = time.perf_counter()
+log.info("loading")
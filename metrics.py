@@ -0,0 +1,75 @@
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Short stages (parsing, cache hits) need finer buckets than the defaults
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0, 120.0)
+
+REQUEST_LATENCY = Histogram(
+    "cinespark_request_seconds", "HTTP request latency", ["route", "method", "status"], buckets=SLOW_BUCKETS)
+LLM_LATENCY = Histogram(
+    "cinespark_llm_call_seconds", "Gemini call latency, without the wait for a concurrency slot", ["mode"], buckets=SLOW_BUCKETS)
+PARSE_TIME = Histogram(
+    "cinespark_json_parse_seconds", "Parsing and validating a model answer, repairs included", buckets=FAST_BUCKETS)
+PDF_RENDER_TIME = Histogram(
+    "cinespark_pdf_render_seconds", "PDF generator run time, without queueing", ["generator"], buckets=SLOW_BUCKETS)
+IMAGE_FETCH_TIME = Histogram(
+    "cinespark_image_fetch_seconds", "Photoboard image download time", ["host", "outcome"], buckets=SLOW_BUCKETS)
+
+STRUCTURED_OUTPUT = Counter(
+    "cinespark_structured_output", "Model answers by how they turned out, see structured.py", ["outcome"])
+
+LLM_IN_FLIGHT = Gauge("cinespark_llm_calls_in_flight", "Gemini calls currently running")
+PDF_IN_FLIGHT = Gauge("cinespark_pdf_renders_in_flight", "PDF renders running or waiting for a worker")
+STARTUP_TIME = Gauge(
+    "cinespark_startup_seconds", "Seconds spent in each startup phase, ready is from the first import to serving", ["phase"])
+
+# Histograms a PDF worker process may observe, sent back to the parent by name
+HISTOGRAMS = {
+    "pdf_render": PDF_RENDER_TIME,
+    "image_fetch": IMAGE_FETCH_TIME,
+}
+
+Observation = Tuple[str, dict, float]
+
+_captured: Optional[List[Observation]] = None
+
+
+def observe(name: str, seconds: float, **labels):
+    histogram = HISTOGRAMS[name]
+    (histogram.labels(**labels) if labels else histogram).observe(seconds)
+    if _captured is not None:
+        _captured.append((name, labels, seconds))
+
+
+@contextmanager
+def capture():
+    '''Collect the observations made in a worker process so the parent can replay them into its own registry'''
+    global _captured
+    _captured = observed = []
+    try:
+        yield observed
+    finally:
+        _captured = None
+
+
+def replay(observed: List[Observation]):
+    for name, labels, seconds in observed:
+        histogram = HISTOGRAMS[name]
+        (histogram.labels(**labels) if labels else histogram).observe(seconds)
+
+
+@contextmanager
+def timer(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - start)
+
+
+def render_latest() -> Tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,29 @@
+import re
+import zipfile
+from io import BytesIO
+from typing import List, Tuple
+
+from pypdf import PdfReader, PdfWriter
+
+
+def safe_filename(name: str) -> str:
+    return re.sub(r"[^\w\- ]+", "", name).strip() or "project"
+
+
+def merge_pdfs(parts: List[Tuple[str, bytes]]) -> bytes:
+    '''Concatenate PDFs into one document with a top-level bookmark per part'''
+    writer = PdfWriter()
+    for title, pdf in parts:
+        writer.append(PdfReader(BytesIO(pdf)), outline_item=title)
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def zip_pdfs(parts: List[Tuple[str, bytes]]) -> bytes:
+    buffer = BytesIO()
+    # PDFs are already compressed, storing them is much faster and barely bigger
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for filename, pdf in parts:
+            archive.writestr(filename, pdf)
+    return buffer.getvalue()
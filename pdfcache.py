@@ -0,0 +1,74 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from pydantic import BaseModel, TypeAdapter
+
+# Bump when a generator changes its output so old renders stop matching
+RENDER_VERSION = "5"
+
+_any = TypeAdapter(object)
+
+
+def render_key(kind: str, project_name: str, payload) -> str:
+    '''Canonical hash of a validated payload, equal payloads always give the same key'''
+    if isinstance(payload, BaseModel):
+        data = payload.model_dump(mode="json")
+    else:
+        data = _any.dump_python(payload, mode="json")
+    canonical = json.dumps([RENDER_VERSION, kind, project_name, data], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+class RenderCache:
+    '''LRU cache of rendered PDFs bounded by their total size in bytes'''
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            pdf = self.entries.get(key)
+            if pdf is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return pdf
+
+    def set(self, key: str, pdf: bytes):
+        if len(pdf) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = pdf
+            self.size += len(pdf)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,149 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from pydantic import TypeAdapter
+
+import metrics
+from imagecache import CacheUsage, image_cache
+from logs import get_logger
+
+from photodata import PhotoboardShotData
+from scriptdata import ScriptData
+from shotdata import ShotData
+from topdfphoto import generate_photoboard_pdf
+from topdfShot import generate_shot_pdf
+from topdfStory import generate_story_pdf
+
+# "process" renders on separate cores, "thread" keeps everything in one process (lower overhead, still off the event loop)
+PDF_EXECUTOR = os.getenv("PDF_EXECUTOR", "process")
+# Worker processes, about 70 MB each and all started at boot. os.cpu_count() is the host's, not the container's
+# quota, so the default stays small enough for a 512 MB instance. Raise it on plans with more cores and memory
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+# Renders allowed to wait for a worker, past that requests are turned away with a 503
+PDF_QUEUE_SIZE = int(os.getenv("PDF_QUEUE_SIZE", "16"))
+
+log = get_logger("pdf")
+
+GENERATORS = {
+    "story": generate_story_pdf,
+    "shot": generate_shot_pdf,
+    "photo": generate_photoboard_pdf,
+}
+
+PAYLOADS = {
+    "story": TypeAdapter(ScriptData),
+    "shot": TypeAdapter(List[ShotData]),
+    "photo": TypeAdapter(List[PhotoboardShotData]),
+}
+
+
+class PoolBusy(Exception):
+    pass
+
+
+def warm_worker(delay: float) -> int:
+    # Holding every worker for a moment makes the pool spawn all of them at startup
+    time.sleep(delay)
+    return os.getpid()
+
+
+def render_pdf(kind: str, project_name: str, data) -> Tuple[bytes, bool]:
+    '''The PDF and whether it is complete, a photoboard showing placeholders for images it could not load is not'''
+    start = time.perf_counter()
+    failed = []
+    try:
+        pdf = GENERATORS[kind](project_name, data, failed=failed) if kind == "photo" else GENERATORS[kind](project_name, data)
+    finally:
+        metrics.observe("pdf_render", time.perf_counter() - start, generator=kind)
+    return pdf, not failed
+
+
+def render_payload(kind: str, project_name: str, payload: bytes) -> Tuple[bytes, bool, List[metrics.Observation], CacheUsage]:
+    '''Runs in a worker process, the payload arrives as JSON and is rebuilt with the rust validator.
+
+    The metrics observed while rendering and the image cache hits and misses come back with the PDF,
+    the worker's own registry and cache counters are never seen by /metrics or /stats.
+    '''
+    before = image_cache.snapshot()
+    with metrics.capture() as observed:
+        pdf, complete = render_pdf(kind, project_name, PAYLOADS[kind].validate_json(payload))
+    return pdf, complete, observed, image_cache.usage_since(before)
+
+
+class PDFPool:
+    '''Runs the PDF generators off the event loop with a bounded number of queued renders'''
+
+    def __init__(self, executor: str = PDF_EXECUTOR, workers: int = PDF_WORKERS, queue_size: int = PDF_QUEUE_SIZE):
+        self.kind = executor
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor: Optional[Executor] = None
+        self.pending = 0
+
+    async def start(self):
+        if self.executor is not None:
+            return
+        if self.kind == "process":
+            # The parent has grpc and event loop threads running, fork is not safe with those
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            executor = self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+            loop = asyncio.get_running_loop()
+            try:
+                await asyncio.gather(*[loop.run_in_executor(executor, warm_worker, 0.2) for _ in range(self.workers)])
+            except BrokenProcessPool:
+                self.reset(executor)
+                raise
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pdf")
+
+    def reset(self, broken: Executor):
+        '''Drop a pool that lost a worker (an OOM kill, a segfault in a C extension), start() builds a new one.
+        Every render that was on it fails the same way, only the first one resets it'''
+        if broken is not None and self.executor is broken:
+            log.warning("pdf worker died, restarting the pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def render(self, kind: str, project_name: str, data) -> Tuple[bytes, bool]:
+        '''The PDF and whether it is complete, see render_pdf'''
+        if self.pending >= self.workers + self.queue_size:
+            raise PoolBusy(f"{self.pending} PDF renders already running or queued")
+        self.pending += 1
+        try:
+            with metrics.PDF_IN_FLIGHT.track_inprogress():
+                if self.kind != "process":
+                    await self.start()
+                    return await asyncio.get_running_loop().run_in_executor(self.executor, render_pdf, kind, project_name, data)
+
+                payload = PAYLOADS[kind].dump_json(data)
+                # A render that was on a broken pool is tried once more on a fresh one
+                for attempt in range(2):
+                    executor = None
+                    try:
+                        await self.start()
+                        executor = self.executor
+                        pdf, complete, observed, usage = await asyncio.get_running_loop().run_in_executor(
+                            executor, render_payload, kind, project_name, payload)
+                    except BrokenProcessPool:
+                        self.reset(executor)
+                        if attempt:
+                            raise PoolBusy("PDF worker died during the render")
+                        continue
+                    metrics.replay(observed)
+                    image_cache.merge(usage)
+                    return pdf, complete
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {"executor": self.kind, "workers": self.workers, "queue_size": self.queue_size, "pending": self.pending}
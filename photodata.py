@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class TechnicalSpecs(BaseModel):
     shot_type: str
@@ -14,5 +14,14 @@ class PhotoboardShotData(BaseModel):
     description: str
     style: str
     image_url: str
+    # Optional hash of the image content, lets the image cache tell apart different images served at the same url
+    image_hash: Optional[str] = None
+    annotations: List[str]
+    technical_specs: TechnicalSpecs
+
+class PhotoPrompt(BaseModel):
+    '''What the model writes for one shot, the rest of PhotoboardShotData comes from the shot itself'''
+    shot_number: int
+    description: str
+    style: str
     annotations: List[str]
-    technical_specs: TechnicalSpecs
\ No newline at end of file
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, List, NamedTuple, Optional
+
+from pydantic import TypeAdapter
+
+from photodata import PhotoboardShotData
+from scriptdata import ScriptData
+from shotdata import ShotData
+
+PROJECT_STORE_PATH = os.getenv("PROJECT_STORE_PATH", "cinespark-projects.sqlite3")
+# Validated documents kept in memory, so a project used on every request is parsed once per version
+PROJECT_CACHE_SIZE = int(os.getenv("PROJECT_CACHE_SIZE", "256"))
+
+# Document kinds a project holds and the schema each one is validated against
+KINDS = {
+    "story": TypeAdapter(ScriptData),
+    "shot": TypeAdapter(List[ShotData]),
+    "photo": TypeAdapter(List[PhotoboardShotData]),
+}
+
+
+class NotFound(Exception):
+    pass
+
+
+class Document(NamedTuple):
+    project_id: str
+    project_name: str
+    kind: str
+    version: int
+    # sha256 of the canonical JSON, equal documents have equal hashes whatever project they are in
+    hash: str
+    created: float
+    data: Any
+
+
+class ProjectStore:
+    '''Projects and their story, shot list and photoboard documents in SQLite.
+
+    Every save of a document adds a new version, saving the same content as the latest version is a no-op.
+    Versions never change once written, so validated documents are cached by (project, kind, version).
+    '''
+
+    def __init__(self, path: str = PROJECT_STORE_PATH, cache_size: int = PROJECT_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS projects (id TEXT PRIMARY KEY, name TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE, kind TEXT NOT NULL, "
+            "version INTEGER NOT NULL, hash TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL, "
+            "PRIMARY KEY (project_id, kind, version))"
+        )
+
+    def create(self, name: str) -> dict:
+        project_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT INTO projects (id, name, created) VALUES (?, ?, ?)", (project_id, name, now))
+        return {"id": project_id, "name": name, "created": now, "documents": {}}
+
+    def project(self, project_id: str) -> dict:
+        '''The project with the latest version of each of its documents'''
+        with self.lock:
+            row = self.db.execute("SELECT name, created FROM projects WHERE id = ?", (project_id,)).fetchone()
+            if row is None:
+                raise NotFound(f"Unknown project {project_id}")
+            latest = self.db.execute(
+                "SELECT kind, MAX(version), COUNT(*) FROM documents WHERE project_id = ? GROUP BY kind", (project_id,)
+            ).fetchall()
+        return {
+            "id": project_id,
+            "name": row[0],
+            "created": row[1],
+            "documents": {kind: {"version": version, "versions": count} for kind, version, count in latest},
+        }
+
+    def require(self, project_id: str):
+        '''Raises NotFound for an unknown project'''
+        with self.lock:
+            if self.db.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone() is None:
+                raise NotFound(f"Unknown project {project_id}")
+
+    def delete(self, project_id: str):
+        with self.lock:
+            deleted = self.db.execute("DELETE FROM projects WHERE id = ?", (project_id,)).rowcount
+            for key in [key for key in self.cache if key[0] == project_id]:
+                del self.cache[key]
+        if not deleted:
+            raise NotFound(f"Unknown project {project_id}")
+
+    def put(self, project_id: str, kind: str, data) -> Document:
+        '''Validate and save a document, raw JSON or Python data, as the next version. Raises ValidationError'''
+        adapter = KINDS[kind]
+        value = adapter.validate_json(data) if isinstance(data, (bytes, str)) else adapter.validate_python(data)
+        content = adapter.dump_json(value).decode("utf-8")
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                project = self.db.execute("SELECT name FROM projects WHERE id = ?", (project_id,)).fetchone()
+                if project is None:
+                    raise NotFound(f"Unknown project {project_id}")
+                latest = self.db.execute(
+                    "SELECT version, hash, created FROM documents WHERE project_id = ? AND kind = ? "
+                    "ORDER BY version DESC LIMIT 1", (project_id, kind)
+                ).fetchone()
+                if latest is not None and latest[1] == digest:
+                    version, now = latest[0], latest[2]
+                else:
+                    version = latest[0] + 1 if latest is not None else 1
+                    self.db.execute(
+                        "INSERT INTO documents (project_id, kind, version, hash, content, created) VALUES (?, ?, ?, ?, ?, ?)",
+                        (project_id, kind, version, digest, content, now),
+                    )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            document = Document(project_id, project[0], kind, version, digest, now, value)
+            self._remember(document)
+        return document
+
+    def get(self, project_id: str, kind: str, version: Optional[int] = None) -> Document:
+        '''A version of a document, the latest one by default'''
+        with self.lock:
+            if version is None:
+                row = self.db.execute(
+                    "SELECT MAX(version) FROM documents WHERE project_id = ? AND kind = ?", (project_id, kind)
+                ).fetchone()
+                version = row[0]
+                if version is None:
+                    raise NotFound(f"Project {project_id} has no {kind}")
+
+            document = self.cache.get((project_id, kind, version))
+            if document is not None:
+                self.cache.move_to_end((project_id, kind, version))
+                self.hits += 1
+                return document
+
+            row = self.db.execute(
+                "SELECT p.name, d.hash, d.created, d.content FROM documents d JOIN projects p ON p.id = d.project_id "
+                "WHERE d.project_id = ? AND d.kind = ? AND d.version = ?", (project_id, kind, version)
+            ).fetchone()
+            if row is None:
+                raise NotFound(f"Project {project_id} has no {kind} version {version}")
+            self.misses += 1
+            document = Document(project_id, row[0], kind, version, row[1], row[2], KINDS[kind].validate_json(row[3]))
+            self._remember(document)
+            return document
+
+    def content(self, project_id: str, kind: str, version: Optional[int] = None) -> Document:
+        '''Like get, but data is the stored JSON text, for serving a document without validating it'''
+        with self.lock:
+            query = (
+                "SELECT p.name, d.version, d.hash, d.created, d.content FROM documents d JOIN projects p ON p.id = d.project_id "
+                "WHERE d.project_id = ? AND d.kind = ? "
+            )
+            if version is None:
+                row = self.db.execute(query + "ORDER BY d.version DESC LIMIT 1", (project_id, kind)).fetchone()
+            else:
+                row = self.db.execute(query + "AND d.version = ?", (project_id, kind, version)).fetchone()
+        if row is None:
+            raise NotFound(f"Project {project_id} has no {kind}" + (f" version {version}" if version is not None else ""))
+        return Document(project_id, row[0], kind, row[1], row[2], row[3], row[4])
+
+    def versions(self, project_id: str, kind: str) -> List[dict]:
+        with self.lock:
+            if self.db.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone() is None:
+                raise NotFound(f"Unknown project {project_id}")
+            rows = self.db.execute(
+                "SELECT version, hash, created FROM documents WHERE project_id = ? AND kind = ? ORDER BY version",
+                (project_id, kind),
+            ).fetchall()
+        return [{"version": version, "hash": digest, "created": created} for version, digest, created in rows]
+
+    def _remember(self, document: Document):
+        key = (document.project_id, document.kind, document.version)
+        self.cache[key] = document
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            projects = self.db.execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+            documents = self.db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            cached = len(self.cache)
+        return {"projects": projects, "documents": documents, "cached": cached, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,88 @@
+# Conversation sessions for the LLM graphs, part of the LLM stack: only storygraphs.py imports this.
+
+import asyncio
+import os
+import time
+import weakref
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+# Sessions kept at once, the least recently used one is dropped past it, and seconds an idle session is kept
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "21600"))
+
+
+class SessionSaver(InMemorySaver):
+    '''LangGraph checkpointer for conversation sessions, bounded in memory.
+
+    Only the latest checkpoint of a session is kept, a new turn never needs the older ones.
+    Sessions past max_sessions or idle for longer than ttl seconds are deleted, least recently used first.
+    '''
+
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl: float = SESSION_TTL):
+        super().__init__()
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        # thread id -> last used, oldest first
+        self.last_used: "OrderedDict[str, float]" = OrderedDict()
+        # Channel versions of the checkpoint kept for each (thread id, namespace), to drop the blobs it replaces
+        self.versions: Dict[Tuple[str, str], dict] = {}
+        self.evicted = 0
+
+    def get_tuple(self, config):
+        # storage is a defaultdict, looking up an unknown session would leave an empty entry behind
+        if config["configurable"]["thread_id"] not in self.storage:
+            return None
+        return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        namespace = config["configurable"].get("checkpoint_ns", "")
+
+        checkpoints = self.storage[thread_id][namespace]
+        for checkpoint_id in [c for c in checkpoints if c != checkpoint["id"]]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, namespace, checkpoint_id), None)
+        previous = self.versions.get((thread_id, namespace), {})
+        for channel, version in new_versions.items():
+            old = previous.get(channel)
+            if old is not None and old != version:
+                self.blobs.pop((thread_id, namespace, channel, old), None)
+        self.versions[(thread_id, namespace)] = dict(checkpoint["channel_versions"])
+
+        self.touch(thread_id)
+        return result
+
+    def touch(self, thread_id: str):
+        now = time.time()
+        self.last_used[thread_id] = now
+        self.last_used.move_to_end(thread_id)
+        while self.last_used:
+            oldest, used = next(iter(self.last_used.items()))
+            if oldest == thread_id or (len(self.last_used) <= self.max_sessions and used > now - self.ttl):
+                break
+            self.delete_thread(oldest)
+            self.evicted += 1
+
+    def delete_thread(self, thread_id: str):
+        super().delete_thread(thread_id)
+        self.last_used.pop(thread_id, None)
+        for key in [key for key in self.versions if key[0] == thread_id]:
+            del self.versions[key]
+
+    def stats(self) -> dict:
+        return {"sessions": len(self.last_used), "max_sessions": self.max_sessions, "ttl": self.ttl, "evicted": self.evicted}
+
+
+# One turn at a time per session, concurrent turns would each start from the same checkpoint and lose one another
+_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def session_lock(session_id: str) -> asyncio.Lock:
+    lock = _locks.get(session_id)
+    if lock is None:
+        lock = _locks[session_id] = asyncio.Lock()
+    return lock
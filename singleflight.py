@@ -0,0 +1,46 @@
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Dict
+
+from pydantic import BaseModel
+
+
+def flight_key(route: str, payload: BaseModel) -> str:
+    '''Canonical hash of a request body, equal payloads give the same key whatever their field order'''
+    canonical = json.dumps([route, payload.model_dump(mode="json")], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    '''Runs one call per key at a time, requests with the same key that arrive meanwhile wait for it and share its result.
+
+    Only covers calls in flight at the same moment, the key is dropped as soon as the call finishes.
+    '''
+
+    def __init__(self):
+        self.calls: Dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        # A caller that disconnects must not cancel the call for the others waiting on it
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the exception as seen, when every caller went away nobody else will
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"started": self.started, "coalesced": self.coalesced, "in_flight": len(self.calls)}
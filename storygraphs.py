@@ -0,0 +1,606 @@
+# Everything that needs langchain and langgraph: the model, the prompts and the compiled graphs.
+# main.py imports this in the background at startup, so the PDF routes answer while it loads.
+
+import asyncio
+import os
+from typing import Annotated, Any, Dict, List, Optional, TypedDict
+
+import jsonpatch
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage, SystemMessage
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import add_messages
+from pydantic import TypeAdapter, ValidationError
+
+import metrics
+from jobs import report_progress
+from llmcache import LLMCache
+from logs import get_logger
+from scriptdata import ScriptData
+from photodata import PhotoboardShotData, PhotoPrompt, TechnicalSpecs
+from sessions import SessionSaver, session_lock
+from shotdata import ShotData
+from structured import StructuredOutputError, count_outcome, parse_structured
+from tokens import check_prompt_size, compact_json, compact_prompt, estimate_tokens, ledger, project_story, usage_tokens
+
+log = get_logger("llm")
+
+class AgentState(TypedDict):
+    story:dict
+    # The user's requests, a session adds each new one to its history
+    idea: Annotated[List[BaseMessage], add_messages]
+    # Older requests of a session, rolled up once they pass SESSION_TOKEN_BUDGET
+    summary: str
+    shot:List[dict]
+    photo: List[dict]
+    finish:bool
+    no_cache: bool
+    errors: List[dict]
+    patch: List[dict]
+
+
+
+# LLM_BACKEND=fake answers with a local deterministic stand-in (fakellm.py), for benchmarks and offline runs
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+if LLM_BACKEND == "fake":
+    from fakellm import FakeChatModel
+    model = FakeChatModel(
+        latency=float(os.getenv("FAKE_LLM_LATENCY", "0.5")),
+        size=int(os.getenv("FAKE_LLM_SIZE", "5")),
+    )
+else:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    model = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
+
+# Max number of Gemini calls in flight at once per worker, the rest wait for a free slot
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))
+llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+# Responses are cached by a hash of the message list, set LLM_CACHE_PATH to keep them in SQLite
+# across restarts and share them between workers
+llm_cache = LLMCache(
+    namespace=getattr(model, "model", "gemini"),
+    max_size=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+    path=os.getenv("LLM_CACHE_PATH") or None,
+)
+
+# Ask Gemini for a JSON mime type answer, no prose or code fences around it
+LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "1") == "1"
+json_generation_config = {"response_mime_type": "application/json"}
+
+async def call_model(messages: List[BaseMessage], no_cache: bool = False, json_mode: bool = False) -> AIMessage:
+    '''Call the model without blocking the event loop, no_cache skips the lookup but still stores the fresh answer'''
+    key = llm_cache.key(messages)
+    if not no_cache:
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            ledger.record(0, 0, cached=True)
+            return AIMessage(content=cached)
+
+    prompt_estimate = check_prompt_size(messages)
+    kwargs = {"generation_config": json_generation_config} if json_mode and LLM_JSON_MODE else {}
+    async with llm_semaphore:
+        with metrics.LLM_IN_FLIGHT.track_inprogress(), metrics.timer(metrics.LLM_LATENCY, mode="invoke"):
+            response = await model.ainvoke(messages, **kwargs)
+    ledger.record(*usage_tokens(response, prompt_estimate, response.content))
+
+    await asyncio.to_thread(llm_cache.set, key, response.content)
+    return response
+
+story_adapter = TypeAdapter(ScriptData)
+shot_list_adapter = TypeAdapter(List[ShotData])
+patch_adapter = TypeAdapter(List[Dict[str, Any]])
+
+async def generate_structured(all_messages: List[BaseMessage], adapter: TypeAdapter, no_cache: bool = False) -> Any:
+    '''Get JSON that validates against the schema: the answer as is, then a local repair, then one targeted re-ask'''
+    response = await call_model(all_messages, no_cache=no_cache, json_mode=True)
+    try:
+        return parse_structured(response.content, adapter)
+    except StructuredOutputError as e:
+        # Don't serve the broken answer again on retry
+        llm_cache.discard(llm_cache.key(all_messages))
+        error = e
+
+    count_outcome("reasked")
+    retry_messages = all_messages + [
+        AIMessage(content=response.content),
+        HumanMessage(content=f"Your answer was not valid: {error}. Respond again with only the corrected JSON."),
+    ]
+    response = await call_model(retry_messages, no_cache=True, json_mode=True)
+    try:
+        data = parse_structured(response.content, adapter, first_try=False)
+    except StructuredOutputError:
+        llm_cache.discard(llm_cache.key(retry_messages))
+        count_outcome("failed")
+        raise
+
+    # Remember the good answer under the original prompt
+    await asyncio.to_thread(llm_cache.set, llm_cache.key(all_messages), response.content)
+    return data
+
+
+#########################SESSIONS##########################################################
+# A request with a session_id runs as the next turn of that session: its idea is added to the session's history
+# and the story and shot list carry over in a checkpoint. Once the history passes SESSION_TOKEN_BUDGET
+# the requests before the last SESSION_KEEP_MESSAGES are rolled into a summary, so prompts stay the same size.
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "500"))
+SESSION_KEEP_MESSAGES = int(os.getenv("SESSION_KEEP_MESSAGES", "4"))
+
+checkpointer = SessionSaver()
+# Standalone graph -> the same graph compiled with the checkpointer
+session_graphs = {}
+
+summary_system_prompt = SystemMessage(content=compact_prompt("""
+    You keep the SESSION SUMMARY of a story development session.
+
+    You get the summary so far, if any, then older requests the user made to change their story or shot list.
+    Respond with an updated summary in plain text, no JSON: every decision and constraint the user asked for
+    that still applies, latest wins, in as few words as possible. Leave out anything later requests undid.
+    """))
+
+def conversation(state : AgentState) -> List[BaseMessage]:
+    '''The requests to put in a prompt, after the summary of the older ones when the session has one'''
+    summary = state.get("summary")
+    head = [HumanMessage(content=f"Summary of my earlier requests: {summary}")] if summary else []
+    return head + list(state["idea"])
+
+async def summarize_node(state : AgentState) -> AgentState:
+    '''Roll the older requests into the summary once the history is over budget, a no-op otherwise'''
+    messages = state["idea"]
+    if len(messages) <= SESSION_KEEP_MESSAGES or estimate_tokens(conversation(state)) <= SESSION_TOKEN_BUDGET:
+        return {}
+
+    older = messages[:-SESSION_KEEP_MESSAGES]
+    all_messages = [summary_system_prompt]
+    if state.get("summary"):
+        all_messages.append(HumanMessage(content=f"Summary so far: {state['summary']}"))
+    all_messages += older
+    try:
+        response = await call_model(all_messages, no_cache=state.get("no_cache", False))
+    except Exception as e:
+        # Keep the full history, the turn itself can still go ahead
+        log.warning("session summary failed", extra={"error": str(e)[:200]})
+        return {}
+
+    log.info("session summarized", extra={"messages": len(older), "tokens": estimate_tokens([response])})
+    return {"summary": response.content, "idea": [RemoveMessage(id=m.id) for m in older]}
+
+def compile_graph(graph : StateGraph):
+    '''Compile a graph for standalone calls, and once more with the checkpointer for session turns'''
+    compiled = graph.compile()
+    session_graphs[compiled] = graph.compile(checkpointer=checkpointer)
+    return compiled
+
+def session_config(session_id: str) -> dict:
+    return {"configurable": {"thread_id": session_id}}
+
+async def session_values(session_id: str) -> dict:
+    '''State a session ended its last turn with, empty for a new session'''
+    snapshot = await next(iter(session_graphs.values())).aget_state(session_config(session_id))
+    return snapshot.values
+
+async def invoke(graph, state : AgentState, session_id: Optional[str] = None) -> AgentState:
+    '''Run a compiled graph, standalone or as the next turn of a session'''
+    if session_id is None:
+        return await graph.ainvoke(state)
+    async with session_lock(session_id):
+        return await session_graphs[graph].ainvoke(state, session_config(session_id))
+
+
+#########################CREATE STORY##########################################################
+story_system_prompt = SystemMessage(content=compact_prompt("""
+   You are a professional story and film development assistant.
+
+    Your task is to respond with a valid JSON object **only**, no explanations or text outside of the JSON.
+
+    The expected structure:
+    {
+    "logline": "string",
+    "synopsis": "string",
+    "three_act_structure": {
+        "act1": "string",
+        "act2": "string",
+        "act3": "string"
+    },
+    "characters": [
+        {
+        "name": "string",
+        "description": "string",
+        "motivation": "string",
+        "arc": "string"
+        }
+    ],
+    "scenes": [
+        {
+        "title": "string",
+        "setting": "string",
+        "description": "string",
+        "characters": ["string"],
+        "key_actions": ["string"]
+        }
+    ]
+    }
+    Respond only with this JSON.
+    """))
+
+def build_story_messages(state : AgentState) -> List[BaseMessage]:
+    story_message = HumanMessage(content=compact_json(state["story"]))
+    all_messages = [story_system_prompt, story_message]
+    all_messages += conversation(state)
+
+    # all_messages = [system_prompt] + list(state["story"]) +  state["idea"]
+    return all_messages
+
+async def create_story_node(state : AgentState) -> AgentState:
+    '''A story node that gneerate a story based on the user story idea'''
+
+    all_messages = build_story_messages(state)
+
+    try:
+        parsed_story = await generate_structured(all_messages, story_adapter, no_cache=state.get("no_cache", False))
+    except StructuredOutputError as e:
+        parsed_story = {"error": f"Failed to parse AI response as JSON: {e}", "raw": e.raw}
+
+    state['story'] = parsed_story
+
+    if "error" in parsed_story:
+        log.warning("story generation failed", extra={"error": parsed_story["error"]})
+    else:
+        log.info("story generated", extra={"scenes": len(parsed_story.get("scenes", [])), "characters": len(parsed_story.get("characters", []))})
+
+    return state
+
+graph = StateGraph(AgentState)
+
+graph.add_node("story_generator", create_story_node)
+graph.add_node("summarizer", summarize_node)
+graph.set_entry_point('summarizer')
+graph.add_edge('summarizer', 'story_generator')
+graph.add_edge('story_generator', END)
+graph_story = compile_graph(graph)
+
+#########################REFINE STORY##########################################################
+# When a story already exists the model only sends back a JSON Patch (RFC 6902) with the change,
+# so a small tweak costs a small answer instead of a whole new story
+patch_system_prompt = SystemMessage(content=compact_prompt("""
+    You are a professional story and film development assistant.
+
+    You get an existing story as JSON, then a change requested by the user.
+    Respond with a JSON Patch (RFC 6902) that applies the change to the story, and nothing else.
+
+    Your task is to respond with a valid JSON array **only**, no explanations or text outside of the JSON.
+
+    The expected structure:
+    [
+    {"op": "replace", "path": "/characters/0/arc", "value": "string"},
+    {"op": "add", "path": "/scenes/-", "value": {"title": "string", "setting": "string", "description": "string", "characters": ["string"], "key_actions": ["string"]}},
+    {"op": "remove", "path": "/scenes/3"}
+    ]
+    Only touch the fields the change needs, keep every other field as it is.
+    Respond only with this JSON.
+    """))
+
+async def refine_story_node(state : AgentState) -> AgentState:
+    '''A story node that asks for a patch against the existing story and applies it'''
+
+    story_message = HumanMessage(content=compact_json(state["story"]))
+    all_messages = [patch_system_prompt, story_message]
+    all_messages += conversation(state)
+
+    try:
+        patch = await generate_structured(all_messages, patch_adapter, no_cache=state.get("no_cache", False))
+        patched = jsonpatch.apply_patch(state["story"], patch)
+        ScriptData.model_validate(patched)
+    except (StructuredOutputError, jsonpatch.JsonPatchException, jsonpatch.JsonPointerException, TypeError, ValidationError) as e:
+        # Leave the story untouched, the graph falls back to regenerating it in full
+        llm_cache.discard(llm_cache.key(all_messages))
+        state['patch'] = None
+        # jsonpatch errors quote the whole document, keep the message short
+        state['errors'] = [{"error": f"Could not apply the story patch: {str(e)[:200]}"}]
+        log.warning("story patch rejected", extra={"error": type(e).__name__})
+        return state
+
+    state['story'] = patched
+    state['patch'] = patch
+
+    log.info("story patched", extra={"operations": len(patch)})
+
+    return state
+
+def route_after_refine(state : AgentState) -> str:
+    return "story_generator" if state["patch"] is None else END
+
+graph = StateGraph(AgentState)
+
+graph.add_node("story_refiner", refine_story_node)
+graph.add_node("story_generator", create_story_node)
+graph.add_node("summarizer", summarize_node)
+graph.set_entry_point('summarizer')
+graph.add_edge('summarizer', 'story_refiner')
+graph.add_conditional_edges('story_refiner', route_after_refine)
+graph.add_edge('story_generator', END)
+graph_story_patch = compile_graph(graph)
+
+#########################CREATE SHOT##########################################################
+
+shot_system_prompt = SystemMessage(content=compact_prompt("""
+    You are a professional Director of Photography.
+
+    Your job is to create a SHOTLIST in JSON format based on the following story.
+
+    Your task is to respond with a valid JSON object **only**, no explanations or text outside of the JSON.
+
+    The expected structure, one object per shot:
+    [
+    {
+        "shot_number": 0,
+        "scene_number": 0,
+        "shot_type": "string",
+        "camera_angle": "string",
+        "camera_movement": "string",
+        "description": "string",
+        "lens_recommendation": "string",
+        "estimated_duration": 0,
+        "notes": "string"
+    }
+    ]
+    Respond only with this JSON.
+
+    Please generate 5 well-thought-out shots.
+    """))
+
+async def create_shot_node(state : AgentState) -> AgentState:
+    '''A shot node that gneerate a shhot based on the user story'''
+
+    system_prompt = shot_system_prompt
+
+    story_message = HumanMessage(content=compact_json(project_story(state["story"], "shot")))
+    shot_message = HumanMessage(content=compact_json(state["shot"])) if state.get("shot") else None
+    all_messages = [system_prompt, story_message]
+    if shot_message:
+        all_messages.append(shot_message)
+    all_messages += conversation(state)
+    # all_messages = [system_prompt] + list(state["story"]) + [state["shot"]] + state["idea"]
+
+    try:
+        parsed_shot = await generate_structured(all_messages, shot_list_adapter, no_cache=state.get("no_cache", False))
+    except StructuredOutputError as e:
+        parsed_shot = {"error": f"Failed to parse AI response as JSON: {e}", "raw": e.raw}
+
+    state['shot'] = parsed_shot
+
+    if isinstance(parsed_shot, dict):
+        log.warning("shot list generation failed", extra={"error": parsed_shot["error"]})
+    else:
+        log.info("shot list generated", extra={"shots": len(parsed_shot)})
+
+    return state
+
+
+
+graph = StateGraph(AgentState)
+
+graph.add_node("shot_generator", create_shot_node)
+graph.add_node("summarizer", summarize_node)
+graph.set_entry_point('summarizer')
+graph.add_edge('summarizer', 'shot_generator')
+graph.add_edge('shot_generator', END)
+graph_shot = compile_graph(graph)
+
+
+#########################CREATE SHOT PER SCENE##########################################################
+# Long stories get one shot list call per scene instead of one call for the whole story,
+# so latency follows the slowest scene rather than the length of the story
+SCENE_CONCURRENCY = int(os.getenv("SCENE_CONCURRENCY", "8"))
+
+scene_shot_system_prompt = SystemMessage(content=compact_prompt("""
+    You are a professional Director of Photography.
+
+    Your job is to create a SHOTLIST in JSON format for ONE scene of the following story.
+    You get the story context first, then the scene to cover.
+
+    Your task is to respond with a valid JSON array **only**, no explanations or text outside of the JSON.
+
+    The expected structure:
+    [
+    {
+        "shot_number": 0,
+        "scene_number": 0,
+        "shot_type": "string",
+        "camera_angle": "string",
+        "camera_movement": "string",
+        "description": "string",
+        "lens_recommendation": "string",
+        "estimated_duration": 0,
+        "notes": "string"
+    }
+    ]
+    Respond only with this JSON.
+
+    Please generate as many well-thought-out shots as the scene needs, usually 3 to 8.
+    """))
+
+async def create_scene_shots(state : AgentState, scene_number: int, scene: dict, limit: asyncio.Semaphore) -> List[dict]:
+    all_messages = [
+        scene_shot_system_prompt,
+        HumanMessage(content=compact_json(project_story(state["story"], "scene_shot"))),
+        HumanMessage(content=compact_json({"scene_number": scene_number, **scene})),
+    ]
+    all_messages += conversation(state)
+
+    async with limit:
+        shots = await generate_structured(all_messages, shot_list_adapter, no_cache=state.get("no_cache", False))
+
+    for shot in shots:
+        shot["scene_number"] = scene_number
+    return shots
+
+async def create_scene_shots_node(state : AgentState) -> AgentState:
+    '''A shot node that generates the shots of every scene concurrently and merges them into one list'''
+
+    scenes = state["story"].get("scenes") or []
+    limit = asyncio.Semaphore(SCENE_CONCURRENCY)
+    done = 0
+
+    async def scene_shots(scene_number: int, scene: dict) -> List[dict]:
+        nonlocal done
+        try:
+            return await create_scene_shots(state, scene_number, scene, limit)
+        finally:
+            done += 1
+            report_progress(done, len(scenes))
+
+    results = await asyncio.gather(
+        *[scene_shots(i + 1, scene) for i, scene in enumerate(scenes)],
+        return_exceptions=True,
+    )
+
+    # Keep whatever scenes came back, report the rest
+    shots = []
+    errors = []
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            errors.append({"scene_number": i + 1, "error": str(result) or type(result).__name__})
+        else:
+            shots += result
+
+    for number, shot in enumerate(shots, start=1):
+        shot["shot_number"] = number
+
+    state['shot'] = shots
+    state['errors'] = errors
+
+    log.info("scene shot lists generated", extra={"shots": len(shots), "scenes": len(scenes), "failed_scenes": len(errors)})
+
+    return state
+
+graph = StateGraph(AgentState)
+
+graph.add_node("scene_shot_generator", create_scene_shots_node)
+graph.add_node("summarizer", summarize_node)
+graph.set_entry_point('summarizer')
+graph.add_edge('summarizer', 'scene_shot_generator')
+graph.add_edge('scene_shot_generator', END)
+graph_shot_scenes = compile_graph(graph)
+
+
+###############--PHOTOBOARD GENERATION--##################
+# The shot list goes to the model in batches of PHOTO_BATCH_SIZE shots, one call per batch and the batches
+# run concurrently, instead of one call per shot. Technical specs are copied from the shots, not generated.
+PHOTO_BATCH_SIZE = int(os.getenv("PHOTO_BATCH_SIZE", "10"))
+PHOTO_CONCURRENCY = int(os.getenv("PHOTO_CONCURRENCY", "8"))
+
+photo_system_prompt = SystemMessage(content=compact_prompt("""
+    You are a professional Director of Photography preparing a PHOTOBOARD.
+
+    You get the story context first, then a list of shots.
+    For every shot write the frame as a photographer would set it up: what is in the frame, the visual style
+    (light, color, mood) and short annotations for the crew.
+
+    Your task is to respond with a valid JSON array **only**, no explanations or text outside of the JSON.
+
+    The expected structure, one object per shot in the list, with the same shot_number:
+    [
+    {
+        "shot_number": 0,
+        "description": "string",
+        "style": "string",
+        "annotations": ["string"]
+    }
+    ]
+    Respond only with this JSON.
+    """))
+
+photo_prompt_adapter = TypeAdapter(List[PhotoPrompt])
+
+def photoboard_entry(shot: dict, prompt: dict) -> dict:
+    return PhotoboardShotData(
+        shot_id=f"shot_{shot['shot_number']}",
+        shot_number=shot["shot_number"],
+        scene_number=shot["scene_number"],
+        description=prompt["description"],
+        style=prompt["style"],
+        # Filled in once an image exists for the frame
+        image_url="",
+        annotations=prompt["annotations"],
+        technical_specs=TechnicalSpecs(
+            shot_type=shot["shot_type"],
+            camera_angle=shot["camera_angle"],
+            camera_movement=shot["camera_movement"],
+            lens_recommendation=shot["lens_recommendation"],
+        ),
+    ).model_dump()
+
+async def create_photo_batch(state : AgentState, batch: List[dict], limit: asyncio.Semaphore) -> List[dict]:
+    all_messages = [
+        photo_system_prompt,
+        HumanMessage(content=compact_json(project_story(state["story"], "photo"))),
+        HumanMessage(content=compact_json(batch)),
+    ]
+    all_messages += conversation(state)
+
+    async with limit:
+        prompts = await generate_structured(all_messages, photo_prompt_adapter, no_cache=state.get("no_cache", False))
+
+    by_number = {prompt["shot_number"]: prompt for prompt in prompts}
+    missing = [shot["shot_number"] for shot in batch if shot["shot_number"] not in by_number]
+    if missing:
+        llm_cache.discard(llm_cache.key(all_messages))
+        raise ValueError(f"No photoboard entry for shots {missing}")
+    return [photoboard_entry(shot, by_number[shot["shot_number"]]) for shot in batch]
+
+async def create_photo_node(state : AgentState) -> AgentState:
+    '''A photoboard node that turns the shot list into photoboard entries, several shots per model call'''
+
+    shots = state["shot"]
+    batches = [shots[i:i + PHOTO_BATCH_SIZE] for i in range(0, len(shots), PHOTO_BATCH_SIZE)]
+    limit = asyncio.Semaphore(PHOTO_CONCURRENCY)
+    done = 0
+
+    async def photo_batch(batch: List[dict]) -> List[dict]:
+        nonlocal done
+        try:
+            return await create_photo_batch(state, batch, limit)
+        finally:
+            done += 1
+            report_progress(done, len(batches))
+
+    results = await asyncio.gather(*[photo_batch(batch) for batch in batches], return_exceptions=True)
+
+    # Keep the batches that came back, report the shots of the others
+    photo = []
+    errors = []
+    for batch, result in zip(batches, results):
+        if isinstance(result, BaseException):
+            errors.append({"shot_numbers": [shot["shot_number"] for shot in batch], "error": str(result) or type(result).__name__})
+        else:
+            photo += result
+
+    state['photo'] = photo
+    state['errors'] = errors
+
+    log.info("photoboard generated", extra={"shots": len(shots), "batches": len(batches), "failed_batches": len(errors)})
+
+    return state
+
+graph = StateGraph(AgentState)
+
+graph.add_node("photo_generator", create_photo_node)
+graph.add_node("summarizer", summarize_node)
+graph.set_entry_point('summarizer')
+graph.add_edge('summarizer', 'photo_generator')
+graph.add_edge('photo_generator', END)
+graph_photo = compile_graph(graph)
+
+
+def initial_state(idea: str, story: dict, shot: Any = None, no_cache: bool = False) -> AgentState:
+    # Only what the request supplies, a session turn would otherwise overwrite the shot list its checkpoint carries
+    state = {
+        'idea': [HumanMessage(content=idea)],
+        'story': story,
+        'finish': False,
+        'no_cache': no_cache,
+    }
+    if shot is not None:
+        state['shot'] = shot
+    return state
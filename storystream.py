@@ -0,0 +1,119 @@
+import json
+from typing import List, Tuple
+
+# Top-level story fields that hold a list, each element is emitted on its own
+LIST_FIELDS = {"characters": "character", "scenes": "scene"}
+
+
+class StoryStreamParser:
+    '''Incremental parser for the story JSON coming out of the model token stream.
+
+    Feed it chunks of text as they arrive, it returns (event, data) pairs for every
+    top-level field of the story as soon as that field is complete:
+    logline, synopsis, each act, each character and each scene.
+    '''
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.started = False
+        self.done = False
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.last_string = None
+        # Open containers, each frame holds the container type, the key it lives under in its parent,
+        # the key (objects) or element index (arrays) currently being filled and where a pending scalar started
+        self.stack = []
+
+    def feed(self, text: str) -> List[Tuple[str, object]]:
+        self.buf += text
+        events = []
+        while self.pos < len(self.buf) and not self.done:
+            try:
+                self._step(self.buf[self.pos], self.pos, events)
+            except ValueError:
+                # Malformed JSON, stop emitting fields and leave the final parse to report it
+                self.done = True
+            self.pos += 1
+        return events
+
+    def _step(self, c, i, events):
+        if not self.started:
+            # Skip anything before the first brace, like a ```json fence
+            if c == "{":
+                self.started = True
+                self.stack.append(self._frame("obj", None, i))
+            return
+
+        frame = self.stack[-1]
+
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif c == "\\":
+                self.escape = True
+            elif c == '"':
+                self.in_string = False
+                self.last_string = self.buf[self.string_start:i + 1]
+                if self._expects_value(frame):
+                    self._complete(frame, self.last_string, events)
+            return
+
+        if c == '"':
+            self.in_string = True
+            self.string_start = i
+        elif c in "{[":
+            name = frame["key"] if frame["type"] == "obj" else None
+            self.stack.append(self._frame("obj" if c == "{" else "arr", name, i))
+        elif c in "}]":
+            self._flush_scalar(frame, i, events)
+            closed = self.stack.pop()
+            if not self.stack:
+                self.done = True
+                return
+            self._complete(self.stack[-1], self.buf[closed["start"]:i + 1], events)
+        elif c == ":":
+            frame["key"] = json.loads(self.last_string)
+        elif c == ",":
+            self._flush_scalar(frame, i, events)
+            frame["completed"] = False
+            if frame["type"] == "obj":
+                frame["key"] = None
+        elif not c.isspace() and self._expects_value(frame) and frame["scalar_start"] is None:
+            # Start of a number, true, false or null
+            frame["scalar_start"] = i
+
+    def _frame(self, kind, name, start):
+        return {"type": kind, "name": name, "start": start, "key": None, "index": 0,
+                "scalar_start": None, "completed": False}
+
+    def _expects_value(self, frame):
+        return not frame["completed"] and (frame["type"] == "arr" or frame["key"] is not None)
+
+    def _flush_scalar(self, frame, i, events):
+        '''Numbers and literals have no closing token, they end at the next , } or ]'''
+        if frame["scalar_start"] is not None:
+            self._complete(frame, self.buf[frame["scalar_start"]:i].strip(), events)
+            frame["scalar_start"] = None
+
+    def _complete(self, frame, raw, events):
+        frame["completed"] = True
+        value = json.loads(raw)
+        depth = len(self.stack)
+
+        if depth == 1:
+            # Lists and the act structure were already emitted piece by piece
+            if frame["key"] not in LIST_FIELDS and frame["key"] != "three_act_structure":
+                events.append((frame["key"], value))
+        elif depth == 2 and frame["name"] == "three_act_structure" and frame["type"] == "obj":
+            events.append(("act", {"act": frame["key"], "text": value}))
+        elif depth == 2 and frame["name"] in LIST_FIELDS and frame["type"] == "arr":
+            events.append((LIST_FIELDS[frame["name"]], {"index": frame["index"], "data": value}))
+
+        if frame["type"] == "arr":
+            frame["index"] += 1
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,157 @@
+import json
+import re
+import time
+from typing import Any
+
+from pydantic import TypeAdapter, ValidationError
+
+from metrics import PARSE_TIME, STRUCTURED_OUTPUT
+
+# How the model answers turn out, exported through /metrics and /stats
+OUTCOMES = (
+    "parsed",          # valid on the first try
+    "parse_failures",  # not valid JSON for the schema as returned
+    "repaired",        # fixed by the local repair pass
+    "reasked",         # needed a second model call
+    "failed",          # still invalid after the re-ask
+)
+for outcome in OUTCOMES:
+    STRUCTURED_OUTPUT.labels(outcome=outcome)
+
+# Only try this many cut points when salvaging a truncated answer, and this many brackets as its start
+MAX_REPAIR_CANDIDATES = 64
+MAX_REPAIR_STARTS = 8
+
+
+def count_outcome(outcome: str):
+    STRUCTURED_OUTPUT.labels(outcome=outcome).inc()
+
+
+def outcome_stats() -> dict:
+    stats = dict.fromkeys(OUTCOMES, 0)
+    for metric in STRUCTURED_OUTPUT.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_total"):
+                stats[sample.labels["outcome"]] = int(sample.value)
+    return stats
+
+
+class StructuredOutputError(Exception):
+    def __init__(self, message: str, raw: str):
+        super().__init__(message)
+        self.raw = raw
+
+
+def strip_fences(text: str) -> str:
+    text = text.strip()
+    text = re.sub(r"^```(?:json)?\s*", "", text)
+    text = re.sub(r"\s*```$", "", text)
+    return text
+
+
+def next_bracket(text: str, start: int) -> int:
+    found = [i for i in (text.find("{", start), text.find("[", start)) if i != -1]
+    return min(found) if found else -1
+
+
+def repair_candidates(text: str):
+    '''Yield repaired versions of a broken answer, best first.
+
+    Drops prose before the first bracket and after the top-level value. When the answer was cut off,
+    it is cut back to the end of the last complete value and the open brackets are closed,
+    trying the most recent cut points first. Prose can hold brackets too ("Here [note]: [...]"),
+    so the brackets after a value that ends are tried as the start in turn.
+    '''
+    start = next_bracket(text, 0)
+    for _ in range(MAX_REPAIR_STARTS):
+        if start == -1:
+            return
+        end = yield from repair_from(text, start)
+        if end is None:
+            # Cut off, every later bracket is inside this value
+            return
+        start = next_bracket(text, end)
+
+
+def repair_from(text: str, start: int):
+    '''Repair candidates of the value starting at text[start], returns where it ended or None when it was cut off'''
+    stack = []
+    in_string = False
+    escape = False
+    cut_points = []
+    end = None
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]":
+            if not stack or stack[-1] != c:
+                end = i
+                break
+            stack.pop()
+            if not stack:
+                # Complete top-level value, anything after it is prose
+                yield text[start:i + 1]
+                return i + 1
+            cut_points.append((i + 1, "".join(reversed(stack))))
+        elif c == "," and stack:
+            cut_points.append((i, "".join(reversed(stack))))
+
+    for cut, closers in reversed(cut_points[-MAX_REPAIR_CANDIDATES:]):
+        yield text[start:cut].rstrip().rstrip(",") + closers
+    return end
+
+
+def parse_structured(text: str, adapter: TypeAdapter, first_try: bool = True) -> Any:
+    '''Parse a model answer and validate it against the schema, with one local repair pass.
+
+    Returns the decoded JSON once it validates, raises StructuredOutputError otherwise.
+    The answer to a re-ask (first_try=False) only counts as "repaired", its outcome is counted by the caller.
+    '''
+    start = time.perf_counter()
+    try:
+        return _parse_structured(text, adapter, first_try)
+    finally:
+        PARSE_TIME.observe(time.perf_counter() - start)
+
+
+def _parse_structured(text: str, adapter: TypeAdapter, first_try: bool) -> Any:
+    try:
+        data = json.loads(strip_fences(text))
+        adapter.validate_python(data)
+        if first_try:
+            count_outcome("parsed")
+        return data
+    except (json.JSONDecodeError, ValidationError) as e:
+        if first_try:
+            count_outcome("parse_failures")
+        error = e
+
+    for candidate in repair_candidates(text):
+        try:
+            data = json.loads(candidate)
+            adapter.validate_python(data)
+        except (json.JSONDecodeError, ValidationError):
+            continue
+        count_outcome("repaired")
+        return data
+
+    raise StructuredOutputError(short_error(error), text)
+
+
+def short_error(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(p) for p in e['loc']) or 'root'}: {e['msg']}" for e in error.errors()[:10]
+        )
+    return str(error)
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    # Only for the annotations, importing langchain_core here would undo the lazy LLM stack in main.py
+    from langchain_core.messages import BaseMessage
+
+# Route of the request being served, set by the middleware in main.py so every model call is booked against it
+current_route: ContextVar[str] = ContextVar("current_route", default="internal")
+
+# Refuse prompts estimated above this many tokens, 0 means no cap
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", "0"))
+# Leave out story fields a stage does not use, see STAGE_FIELDS
+PROMPT_TRIM_STORY = os.getenv("PROMPT_TRIM_STORY", "1") == "1"
+
+# Story fields each stage sends to the model, None keeps the whole field, a list keeps those keys of each item
+STAGE_FIELDS = {
+    "shot": {
+        "logline": None,
+        "synopsis": None,
+        "characters": ["name", "description"],
+        "scenes": None,
+    },
+    "scene_shot": {
+        "logline": None,
+        "characters": ["name", "description"],
+    },
+    "photo": {
+        "logline": None,
+        "characters": ["name", "description"],
+    },
+}
+
+
+class PromptTooLarge(Exception):
+    def __init__(self, estimated: int, limit: int):
+        super().__init__(f"Prompt is about {estimated} tokens, the limit is {limit}")
+        self.estimated = estimated
+        self.limit = limit
+
+
+def compact_json(data) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def compact_prompt(text: str) -> str:
+    '''Drop the indentation of a triple quoted prompt, it costs tokens and tells the model nothing'''
+    return "\n".join(line.strip() for line in text.strip().splitlines())
+
+
+def project_story(story: dict, stage: str) -> dict:
+    fields = STAGE_FIELDS.get(stage)
+    if not PROMPT_TRIM_STORY or fields is None or not isinstance(story, dict):
+        return story
+    projected = {}
+    for field, keys in fields.items():
+        if field not in story:
+            continue
+        value = story[field]
+        if keys is not None and isinstance(value, list):
+            value = [{k: item[k] for k in keys if k in item} if isinstance(item, dict) else item for item in value]
+        projected[field] = value
+    return projected
+
+
+def estimate_tokens(messages: List["BaseMessage"]) -> int:
+    '''Rough local count, about 4 characters per token, used for the cap before the call'''
+    return sum(len(str(m.content)) for m in messages) // 4 + 4 * len(messages)
+
+
+def check_prompt_size(messages: List["BaseMessage"]) -> int:
+    estimated = estimate_tokens(messages)
+    if MAX_PROMPT_TOKENS and estimated > MAX_PROMPT_TOKENS:
+        raise PromptTooLarge(estimated, MAX_PROMPT_TOKENS)
+    return estimated
+
+
+class TokenLedger:
+    '''Prompt and completion tokens per route, from the usage Gemini reports (or the local estimate without it)'''
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def record(self, prompt_tokens: int, completion_tokens: int, cached: bool = False, route: Optional[str] = None):
+        route = route or current_route.get()
+        with self.lock:
+            entry = self.routes.setdefault(route, {
+                "calls": 0,
+                "cached_calls": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "max_prompt_tokens": 0,
+            })
+            entry["calls"] += 1
+            if cached:
+                entry["cached_calls"] += 1
+                return
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["max_prompt_tokens"] = max(entry["max_prompt_tokens"], prompt_tokens)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {route: dict(entry) for route, entry in self.routes.items()}
+
+
+def usage_tokens(message, prompt_estimate: int, completion_text: str = ""):
+    '''(prompt, completion) tokens of an answer, falling back to estimates when the model reports no usage'''
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", prompt_estimate), usage.get("output_tokens", 0)
+    return prompt_estimate, len(completion_text) // 4
+
+
+ledger = TokenLedger()
@@ -1,6 +1,8 @@
 from fpdf import FPDF
+from fpdf.enums import MethodReturnValue
+from itertools import accumulate
 from shotdata import ShotData
-from typing import List, Dict
+from typing import List, Dict, NamedTuple, Optional
 
 # Data strcutre example 
 data = [
@@ -75,6 +77,22 @@ data = [
 black_rgb = (0, 0, 0)
 white_rgb = (255, 255, 255)
 
+HEADERS = ["Shot #", "Scene", "Type", "Angle", "Movement", "Description", "Lens", "Duration", "Notes"]
+LINE_HEIGHT = 5  # 5mm per line
+
+def shot_values(shot: ShotData) -> List[str]:
+    return [
+        str(shot.shot_number),
+        str(shot.scene_number),
+        shot.shot_type,
+        shot.camera_angle,
+        shot.camera_movement,
+        shot.description,
+        shot.lens_recommendation,
+        str(shot.estimated_duration),
+        shot.notes
+    ]
+
 class PDF(FPDF):
     def header(self):
         self.set_font("Helvetica", "B", 14)
@@ -88,93 +106,84 @@ class PDF(FPDF):
 
     def table_header(self, col_widths):
         self.set_font("Helvetica", "B", 10)
-        headers = ["Shot #", "Scene", "Type", "Angle", "Movement", "Description", "Lens", "Duration", "Notes"]
-        for i, header in enumerate(headers):
+        for i, header in enumerate(HEADERS):
             self.multi_cell(col_widths[i], 8, header, border=1, align="C", max_line_height=self.font_size, new_x="RIGHT", new_y="TOP")
         self.ln()
-
-    def table_row(self, shot, col_widths):
-        
-        
-
         self.set_font("Helvetica", "", 9)
 
-        values = [
-          str(shot.shot_number),
-          str(shot.scene_number),
-          shot.shot_type,
-          shot.camera_angle,
-          shot.camera_movement,
-          shot.description,
-          shot.lens_recommendation,
-          str(shot.estimated_duration),
-          shot.notes
-        ]
-
-        # Calculate number of lines each cell would take
-        line_counts = [
-            len(self.multi_cell(col_widths[i], 5, val, split_only=True))
-            for i, val in enumerate(values)
-        ]
-        max_lines = max(line_counts)
-        row_height = max_lines * 5  # 5mm per line
-
-        line_height = [row_height / line for line in line_counts]
-
+    def table_row(self, row: "MeasuredRow", layout: "ShotTableLayout"):
+        '''Draw a row from its measured lines, the text is not wrapped again'''
         x_start = self.get_x()
         y_start = self.get_y()
 
-        # Draw each cell manually
-        for i, val in enumerate(values):
-            self.set_xy(x_start + sum(col_widths[:i]), y_start)
-            self.multi_cell(col_widths[i], line_height[i], val, border=1, align="L")
-
-            # Reset Y position so the next cell stays aligned
-            self.set_xy(x_start + sum(col_widths[:i+1]), y_start)
+        for i, lines in enumerate(row.lines):
+            x = x_start + layout.col_offsets[i]
+            width = layout.col_widths[i]
+            # Lines are spread over the full row height, like multi_cell with a taller line height
+            line_height = row.height / len(lines)
+            for j, line in enumerate(lines):
+                self.set_xy(x, y_start + j * line_height)
+                self.cell(width, line_height, line, align="L")
+            self.rect(x, y_start, width, row.height)
 
         # Move cursor to the beginning of the next row
-        self.set_xy(x_start, y_start + row_height)
+        self.set_xy(x_start, y_start + row.height)
 
     def get_string_height(self, w, text):
         return self.get_string_width(text) / w * self.font_size + 2
 
-def generate_shot_pdf(project_name: str, data: List[ShotData], file_path: str):
+
+class MeasuredRow(NamedTuple):
+    lines: List[List[str]]
+    height: float
+
+
+class ShotTableLayout:
+    '''Measures each row once, the same measurement drives both pagination and drawing.
+
+    Short columns repeat the same few values (Static, Eye-level, 50mm lens...) so wrapped
+    lines are memoized per column and value.
+    '''
+
+    def __init__(self, pdf: PDF, col_widths: List[float]):
+        self.pdf = pdf
+        self.col_widths = col_widths
+        self.col_offsets = list(accumulate(col_widths, initial=0))
+        self.wrapped = {}
+
+    def measure(self, values: List[str]) -> MeasuredRow:
+        lines = []
+        for i, val in enumerate(values):
+            key = (i, val)
+            wrapped = self.wrapped.get(key)
+            if wrapped is None:
+                wrapped = self.pdf.multi_cell(self.col_widths[i], LINE_HEIGHT, val, dry_run=True, output=MethodReturnValue.LINES)
+                self.wrapped[key] = wrapped
+            lines.append(wrapped)
+        return MeasuredRow(lines, max(len(l) for l in lines) * LINE_HEIGHT)
+
+
+def generate_shot_pdf(project_name: str, data: List[ShotData], file_path: Optional[str] = None) -> Optional[bytes]:
+    '''Render the PDF into file_path, or return it as bytes when no path is given'''
     pdf = PDF(orientation='L', unit='mm', format='A4')
     pdf.set_auto_page_break(auto=True, margin=10)
     pdf.add_page()
 
     col_widths = [14, 14, 20, 20, 20, 70, 25, 20, 70]
+    layout = ShotTableLayout(pdf, col_widths)
 
     pdf.chapter_title(f"{project_name} - Shot List")
     pdf.table_header(col_widths)
     for shot in data:
-    # Estimate the row height
-      values = [
-          str(shot.shot_number),
-          str(shot.scene_number),
-          shot.shot_type,
-          shot.camera_angle,
-          shot.camera_movement,
-          shot.description,
-          shot.lens_recommendation,
-          str(shot.estimated_duration),
-          shot.notes
-      ]
-      
-      # Use split_only=True to get line count for each cell
-      line_counts = [
-          len(pdf.multi_cell(col_widths[i], 5, val, split_only=True))
-          for i, val in enumerate(values)
-      ]
-      max_lines = max(line_counts)
-      estimated_row_height = max_lines * 5  # 5 mm per line
-
-      # Check if there's enough space left on the page
-      if pdf.get_y() + estimated_row_height > pdf.h - pdf.b_margin:
-          pdf.add_page()
-          pdf.table_header(col_widths)
-
-      # Now draw the row
-      pdf.table_row(shot, col_widths)
-
-    pdf.output(file_path)
\ No newline at end of file
+        row = layout.measure(shot_values(shot))
+
+        # Check if there's enough space left on the page
+        if pdf.get_y() + row.height > pdf.h - pdf.b_margin:
+            pdf.add_page()
+            pdf.table_header(col_widths)
+
+        pdf.table_row(row, layout)
+
+    if file_path is None:
+        return bytes(pdf.output())
+    pdf.output(file_path)
@@ -1,5 +1,6 @@
 from fpdf import FPDF
 from scriptdata import ScriptData
+from typing import Optional
 
 # Data strcutre example 
 data = {
@@ -91,7 +92,8 @@ class PDF(FPDF):
         self.ln()
 
 
-def generate_story_pdf(project_name: str, data: ScriptData, file_path: str):
+def generate_story_pdf(project_name: str, data: ScriptData, file_path: Optional[str] = None) -> Optional[bytes]:
+    '''Render the PDF into file_path, or return it as bytes when no path is given'''
     pdf = PDF()
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
@@ -136,6 +138,8 @@ def generate_story_pdf(project_name: str, data: ScriptData, file_path: str):
         pdf.sub_chapter_title("Key Actions")
         pdf.chapter_body(", ".join(scene.key_actions))
 
+    if file_path is None:
+        return bytes(pdf.output())
     pdf.output(file_path)
 
 
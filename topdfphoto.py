@@ -1,17 +1,49 @@
 from fpdf import FPDF
-import requests
-from PIL import Image
+from fpdf.image_parsing import preload_image
 from io import BytesIO
-import os
-import tempfile
 from photodata import PhotoboardShotData, TechnicalSpecs
-from typing import List, Dict
-import uuid
+from typing import List, Dict, Optional, Tuple
+from imagefetch import FetchResult, fetch_image, fetch_images, placeholder_image
+import imagecache
+from imagecache import image_cache, downsample_to_fit
 
 black_rgb = (0, 0, 0)
 white_rgb = (255, 255, 255)
 
+def shrink_download(result: FetchResult, content_hash: Optional[str] = None) -> FetchResult:
+    '''Downsample a download into the image cache right away, the raw bytes are dropped with the original result'''
+    if result.content is None:
+        return result
+    try:
+        return result._replace(content=image_cache.put(result.url, result.content, content_hash))
+    except Exception as e:
+        return result._replace(content=None, error=str(e))
+
+
+def image_identity(url: str, content_hash: Optional[str] = None) -> Tuple[str, str]:
+    '''Shots show the same image when they give the same content hash, or without one the same url'''
+    return ("hash", content_hash) if content_hash else ("url", url)
+
+
 class PDFPhotoboard(FPDF):
+    def __init__(self, *args, images: Optional[Dict[str, FetchResult]] = None,
+                 sources: Optional[Dict[Tuple[str, str], str]] = None,
+                 image_budget: int = imagecache.PHOTOBOARD_IMAGE_BYTES, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Downloads done up front by generate_photoboard_pdf, keyed by url, already downsampled
+        self.images = images or {}
+        # Url each distinct image is loaded from, shots sharing a content hash may list different urls
+        self.sources = sources or {}
+        # Images already loaded for this document: (fpdf image name, (width, height), error), by image identity.
+        # The JPEG itself is only held by fpdf's image cache, later shots embed it by name
+        self.loaded: Dict[Tuple[str, str], Tuple[str, Tuple[int, int], Optional[str]]] = {}
+        # Every distinct image gets an equal share of what is left of the budget when it is loaded
+        self.image_budget = image_budget
+        self.budget_left = image_budget
+        self.images_left = len(self.sources)
+        # Urls of the images shown as a placeholder because they could not be loaded
+        self.failed: List[str] = []
+
     def header(self):
         self.set_fill_color(*white_rgb)
         self.rect(0, 0, self.w, self.h, 'F')
@@ -34,32 +66,73 @@ class PDFPhotoboard(FPDF):
         self.multi_cell(0, 8, text)
         self.ln(1)
 
-    def add_image_from_url(self, url, max_width=120, max_height=90):
-        try:
-            response = requests.get(url)
-            image = Image.open(BytesIO(response.content))
-            temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}.jpg")
-            image.convert("RGB").save(temp_path)
-
-            img_w, img_h = image.size
-            aspect = img_h / img_w
-
-            width = min(max_width, self.w - 40)
-            height = width * aspect
-            if height > max_height:
-                height = max_height
-                width = height / aspect
-
-            x = (self.w - width) / 2
-            y = self.get_y()
-            self.image(temp_path, x=x, y=y, w=width, h=height)
-            self.ln(height + 5)
-        except Exception as e:
-            self.section_body(f"Could not load image: {e}")
-            self.ln(5)
-
-def generate_photoboard_pdf(project_name: str, photoboard_data: List[PhotoboardShotData], file_path: str):
-    pdf = PDFPhotoboard()
+    def load_image(self, url, content_hash=None):
+        # Prefetched because the image cache didn't have it, taken out of the results so nothing else keeps it
+        # alive once it is embedded
+        fetched = self.images.pop(url, None)
+        error = None
+        if fetched is not None:
+            image_cache.miss()
+            jpeg, error = fetched.content, fetched.error
+        else:
+            # Downsampled JPEGs come from the image cache, only new images are decoded and shrunk here
+            jpeg = image_cache.get(url, content_hash)
+            if jpeg is None:
+                fetched = shrink_download(fetch_image(url), content_hash)
+                jpeg, error = fetched.content, fetched.error
+        if jpeg is None:
+            jpeg = placeholder_image()
+            self.failed.append(url)
+
+        if self.image_budget:
+            share = self.budget_left // max(1, self.images_left)
+            if len(jpeg) > share:
+                jpeg = downsample_to_fit(jpeg, share, image_cache.dpi, image_cache.quality)
+            self.budget_left = max(0, self.budget_left - len(jpeg))
+            self.images_left = max(0, self.images_left - 1)
+
+        # fpdf reads the JPEG header and keeps the stream as is, named by the md5 of its bytes
+        name, _, info = preload_image(self.image_cache, BytesIO(jpeg))
+        return name, (info["w"], info["h"]), error
+
+    def add_image_from_url(self, url, max_width=120, max_height=90, content_hash=None):
+        identity = image_identity(url, content_hash)
+        if identity not in self.loaded:
+            self.loaded[identity] = self.load_image(self.sources.get(identity, url), content_hash)
+        # A repeated image is one XObject used on several pages
+        name, (img_w, img_h), error = self.loaded[identity]
+
+        aspect = img_h / img_w
+
+        width = min(max_width, self.w - 40)
+        height = width * aspect
+        if height > max_height:
+            height = max_height
+            width = height / aspect
+
+        x = (self.w - width) / 2
+        y = self.get_y()
+        self.image(name, x=x, y=y, w=width, h=height)
+        self.ln(height + 5)
+        if error:
+            self.section_body(f"Could not load image: {error}")
+
+def generate_photoboard_pdf(project_name: str, photoboard_data: List[PhotoboardShotData], file_path: Optional[str] = None,
+                            failed: Optional[List[str]] = None) -> Optional[bytes]:
+    '''Render the PDF into file_path, or return it as bytes when no path is given.
+    The urls of images that could not be loaded are added to failed'''
+    # One download per distinct image, in parallel, before laying out the pages
+    sources = {}
+    for shot in photoboard_data:
+        sources.setdefault(image_identity(shot.image_url, shot.image_hash), shot.image_url)
+    hashes = {url: value for (kind, value), url in sources.items() if kind == "hash"}
+    # Downsampled in the download threads, only the small JPEGs wait for the layout
+    images = fetch_images(
+        (url for url in sources.values() if not image_cache.contains(url, hashes.get(url))),
+        process=lambda result: shrink_download(result, hashes.get(result.url)),
+    )
+
+    pdf = PDFPhotoboard(images=images, sources=sources)
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
     pdf.chapter_title(f"{project_name} - Photoboard")
@@ -67,7 +140,7 @@ def generate_photoboard_pdf(project_name: str, photoboard_data: List[PhotoboardS
     for shot in sorted(photoboard_data, key=lambda x: (x.scene_number, x.shot_number)):
         pdf.section_title(f"Scene {shot.scene_number} - Shot {shot.shot_number}")
         pdf.section_body(f"{shot.description}")
-        pdf.add_image_from_url(shot.image_url)
+        pdf.add_image_from_url(shot.image_url, content_hash=shot.image_hash)
 
         # Technical Specs
         specs = shot.technical_specs
@@ -83,7 +156,14 @@ def generate_photoboard_pdf(project_name: str, photoboard_data: List[PhotoboardS
             pdf.section_body("Notes: " + ", ".join(shot.annotations))
         pdf.add_page()
 
+    if failed is not None:
+        failed.extend(pdf.failed)
 
+    if file_path is None:
+        output = pdf.output()
+        # Free the document and its images before the copy to bytes
+        del pdf
+        return bytes(output)
     pdf.output(file_path)
 
 
@@ -0,0 +1,169 @@
+import os
+from contextvars import ContextVar
+from typing import Any, Callable, Dict
+
+import orjson
+import ormsgpack
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    # Optional, without it responses are only gzipped
+    brotli = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+# Responses smaller than this are sent as they are
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+# Already compressed, another pass only costs CPU. Event streams are left alone by the responders themselves
+COMPRESSED_TYPES = ("application/pdf", "application/zip", "image/")
+
+# Format the current request asked for in its Accept header, "json" or "msgpack"
+response_format: ContextVar[str] = ContextVar("response_format", default="json")
+
+
+def parse_accept(header: str) -> Dict[str, float]:
+    '''Media types or encodings of an Accept style header with their q values'''
+    accepted = {}
+    for part in header.split(","):
+        value, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, number = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        if value:
+            accepted[value.strip().lower()] = q
+    return accepted
+
+
+def prefers_msgpack(accept: str) -> bool:
+    '''MessagePack only when the client names it and ranks it at least as high as JSON'''
+    accepted = parse_accept(accept)
+    msgpack = max((accepted.get(t, 0.0) for t in MSGPACK_TYPES), default=0.0)
+    return msgpack > 0 and msgpack >= accepted.get("application/json", 0.0)
+
+
+def is_msgpack(content_type: str) -> bool:
+    return content_type.split(";")[0].strip().lower() in MSGPACK_TYPES
+
+
+def _default(value: Any):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class WireResponse(JSONResponse):
+    '''JSON through orjson, or MessagePack when the request asked for it.
+
+    Routes that return this directly also skip FastAPI's jsonable_encoder pass over the content.
+    '''
+
+    def render(self, content: Any) -> bytes:
+        if response_format.get() == "msgpack":
+            self.media_type = "application/msgpack"
+            return ormsgpack.packb(content, default=_default, option=ormsgpack.OPT_SERIALIZE_PYDANTIC | ormsgpack.OPT_NON_STR_KEYS)
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class WireRequest(Request):
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            self._json = ormsgpack.unpackb(body) if self.scope.get("wire_format") == "msgpack" else orjson.loads(body)
+        return self._json
+
+
+class WireRoute(APIRoute):
+    '''Reads MessagePack request bodies and picks the response format from the Accept header.
+
+    A MessagePack body is shown to FastAPI as JSON, so it goes through the same validation as a JSON one.
+    '''
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def wire_handler(request: Request) -> Response:
+            scope = request.scope
+            if is_msgpack(request.headers.get("content-type", "")):
+                headers = [(k, v) for k, v in scope["headers"] if k != b"content-type"]
+                scope = {**scope, "headers": headers + [(b"content-type", b"application/json")], "wire_format": "msgpack"}
+            response_format.set("msgpack" if prefers_msgpack(request.headers.get("accept", "")) else "json")
+            return await handler(WireRequest(scope, request.receive))
+
+        return wire_handler
+
+
+async def read_body(request: Request):
+    '''The raw JSON body, for pydantic to parse and validate in one pass, or the decoded MessagePack body'''
+    body = await request.body()
+    if request.scope.get("wire_format") != "msgpack":
+        return body
+    try:
+        return ormsgpack.unpackb(body)
+    except ormsgpack.MsgpackDecodeError:
+        raise HTTPException(status_code=400, detail="There was an error parsing the body")
+
+
+##################----COMPRESSION---#############
+class SkipCompressed:
+    '''Leave PDFs, archives and images as they are'''
+
+    async def send_with_compression(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            await super().send_with_compression(message)
+            self.content_type_is_excluded = self.content_type_is_excluded or content_type.startswith(COMPRESSED_TYPES)
+            return
+        await super().send_with_compression(message)
+
+
+class GzipResponder(SkipCompressed, GZipResponder):
+    pass
+
+
+class BrotliResponder(SkipCompressed, IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int = BROTLI_QUALITY):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        data = self.compressor.process(body)
+        return data + (self.compressor.flush() if more_body else self.compressor.finish())
+
+
+class CompressionMiddleware:
+    '''Brotli when the client accepts it and the brotli package is installed, else gzip'''
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accepted = parse_accept(Headers(scope=scope).get("accept-encoding", ""))
+        if brotli is not None and accepted.get("br", 0) > 0:
+            responder = BrotliResponder(self.app, self.minimum_size)
+        elif accepted.get("gzip", 0) > 0:
+            responder = GzipResponder(self.app, self.minimum_size, compresslevel=GZIP_LEVEL)
+        else:
+            await self.app(scope, receive, send)
+            return
+        await responder(scope, receive, send)